@@ -1,3 +1,3 @@
 #!/bin/bash
 
-daphne -b 0.0.0.0 -p 8080 whistle.asgi:application "$@"
\ No newline at end of file
+python -m realtime.server -b 0.0.0.0 -p 8080 whistle.asgi:application "$@"
\ No newline at end of file
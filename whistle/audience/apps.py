@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class AudienceConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "audience"
+
+    def ready(self):
+        from django.db.models.fields.json import KeyTransform
+
+        from audience.lookups import JSONType
+
+        KeyTransform.register_lookup(JSONType)
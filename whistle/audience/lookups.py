@@ -0,0 +1,7 @@
+from django.db.models import CharField, Transform
+
+
+class JSONType(Transform):
+    lookup_name = "json_type"
+    function = "jsonb_typeof"
+    output_field = CharField()
@@ -0,0 +1,53 @@
+# Generated by Django 5.0.6 on 2026-10-19 10:08
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("audience", "0001_initial"),
+        ("organization", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="MetadataKey",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("key", models.CharField()),
+                (
+                    "type",
+                    models.CharField(
+                        choices=[
+                            ("STRING", "STRING"),
+                            ("NUMBER", "NUMBER"),
+                            ("BOOLEAN", "BOOLEAN"),
+                        ]
+                    ),
+                ),
+                ("indexed", models.BooleanField(default=False)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "organization",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="organization.organization",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("organization", "key")},
+            },
+        ),
+    ]
@@ -34,5 +34,29 @@ class Filter(models.Model):
     operator = models.CharField(choices=OperatorChoices.choices)
     value = fields.EncryptedField(EncryptedFieldTypeChoices.PERSONAL_DATA)
 
+    objects = fields.EncryptedQuerySet.as_manager()
+
     class Meta:
         unique_together = [["audience", "property"]]
+
+
+class MetadataKeyTypeChoices(models.TextChoices):
+    STRING = "STRING", "STRING"
+    NUMBER = "NUMBER", "NUMBER"
+    BOOLEAN = "BOOLEAN", "BOOLEAN"
+
+
+class MetadataKey(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE)
+    key = models.CharField()
+    type = models.CharField(choices=MetadataKeyTypeChoices.choices)
+    indexed = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = [["organization", "key"]]
+
+    @property
+    def index_name(self):
+        return f"metadata_key_{self.id.hex}"
@@ -1,9 +1,14 @@
 import logging
+import re
 
 from django.db import transaction, DatabaseError
 from rest_framework import serializers
 
-from audience.models import Audience, Filter, OperatorChoices
+from audience.models import Audience, Filter, MetadataKey, OperatorChoices
+
+metadata_key_pattern = re.compile(
+    r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$"
+)
 
 
 class FilterSerializer(serializers.ModelSerializer):
@@ -86,3 +91,33 @@ class AudienceSerializer(serializers.ModelSerializer):
                 "Failed to update audience for org: %s with error: %s", org.id, error
             )
             raise
+
+
+class MetadataKeySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MetadataKey
+        fields = ["id", "key", "type", "indexed", "created_at"]
+
+    def validate_key(self, value):
+        # keys are compiled into json lookups and index expressions
+        if not metadata_key_pattern.match(value) or "__" in value:
+            raise serializers.ValidationError(
+                "Metadata keys are dot separated identifiers.", "invalid_metadata_key"
+            )
+        org = self.context["request"].user
+        if MetadataKey.objects.filter(organization=org, key=value).exists():
+            raise serializers.ValidationError(
+                f"Metadata key '{value}' already exists.", "metadata_key_exists"
+            )
+        return value
+
+    def create(self, validated_data):
+        org = self.context["request"].user
+        instance = MetadataKey.objects.create(organization=org, **validated_data)
+        logging.info(
+            "Metadata key: %s with type: %s created for org: %s",
+            instance.key,
+            instance.type,
+            org.id,
+        )
+        return instance
@@ -0,0 +1,59 @@
+import logging
+
+from django.db import connection
+
+from audience.models import MetadataKey
+from external_user.models import ExternalUser
+from whistle.celery import app
+
+
+@app.task(bind=True, ignore_result=True, queue="maintenance")
+def create_metadata_key_index(self, metadata_key_id):
+    metadata_key = MetadataKey.objects.filter(pk=metadata_key_id).first()
+    if metadata_key is None or not metadata_key.indexed:
+        return
+    if connection.vendor != "postgresql":
+        return
+
+    with connection.schema_editor(atomic=False) as schema_editor:
+        # must match the expression audience comparisons compile to for the planner to use it
+        statement = (
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS %s ON %s ((%s)) WHERE %s = %s"
+            % (
+                schema_editor.quote_name(metadata_key.index_name),
+                schema_editor.quote_name(ExternalUser._meta.db_table),
+                get_metadata_expression(schema_editor, metadata_key.key),
+                schema_editor.quote_name("organization_id"),
+                schema_editor.quote_value(str(metadata_key.organization_id)),
+            )
+        )
+        schema_editor.execute(statement, params=None)
+    logging.info(
+        "Created index: %s for metadata key: %s of org: %s",
+        metadata_key.index_name,
+        metadata_key.key,
+        metadata_key.organization_id,
+    )
+
+
+@app.task(bind=True, ignore_result=True, queue="maintenance")
+def drop_metadata_key_index(self, index_name):
+    if connection.vendor != "postgresql":
+        return
+
+    with connection.schema_editor(atomic=False) as schema_editor:
+        schema_editor.execute(
+            "DROP INDEX CONCURRENTLY IF EXISTS %s"
+            % schema_editor.quote_name(index_name),
+            params=None,
+        )
+    logging.info("Dropped metadata key index: %s", index_name)
+
+
+def get_metadata_expression(schema_editor, key):
+    # same operators as django's KeyTransform on postgres
+    path = key.split(".")
+    column = schema_editor.quote_name("metadata")
+    if len(path) > 1:
+        return "%s #> %s" % (column, schema_editor.quote_value("{%s}" % ",".join(path)))
+    return "%s -> %s" % (column, schema_editor.quote_value(path[0]))
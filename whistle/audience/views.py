@@ -1,7 +1,10 @@
-from rest_framework.viewsets import ModelViewSet
+from django.db import transaction
+from rest_framework import mixins
+from rest_framework.viewsets import ModelViewSet, GenericViewSet
 
-from audience.models import Audience
-from audience.serializers import AudienceSerializer
+from audience.models import Audience, MetadataKey
+from audience.serializers import AudienceSerializer, MetadataKeySerializer
+from audience.tasks import create_metadata_key_index, drop_metadata_key_index
 from whistle.auth import ServerAuth
 from whistle.pagination import StandardLimitOffsetPagination
 
@@ -15,3 +18,33 @@ class AudienceViewSet(ModelViewSet):
     def get_queryset(self):
         org = self.request.user
         return self.queryset.filter(organization=org)
+
+
+class MetadataKeyViewSet(
+    mixins.CreateModelMixin,
+    mixins.RetrieveModelMixin,
+    mixins.ListModelMixin,
+    mixins.DestroyModelMixin,
+    GenericViewSet,
+):
+    queryset = MetadataKey.objects.all()
+    serializer_class = MetadataKeySerializer
+    authentication_classes = [ServerAuth]
+    pagination_class = StandardLimitOffsetPagination
+
+    def get_queryset(self):
+        org = self.request.user
+        return self.queryset.filter(organization=org).order_by("created_at")
+
+    def perform_create(self, serializer):
+        instance = serializer.save()
+        if instance.indexed:
+            # indexes are built concurrently, which can take a while on large orgs
+            transaction.on_commit(lambda: create_metadata_key_index.delay(instance.id))
+
+    def perform_destroy(self, instance):
+        index_name = instance.index_name
+        indexed = instance.indexed
+        instance.delete()
+        if indexed:
+            transaction.on_commit(lambda: drop_metadata_key_index.delay(index_name))
@@ -0,0 +1,216 @@
+import contextlib
+import time
+import uuid
+from collections import Counter
+
+from aws_encryption_sdk.exceptions import CacheKeyError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from encryption.models import DataKey
+from external_user.models import ExternalUser
+from organization.models import Organization
+from whistle import fields, settings, utils
+from whistle.fields import EncryptionModeChoices
+from whistle.kms import MasterKeyProviderChoices, get_master_key_client
+
+
+class Command(BaseCommand):
+    help = "Measures encryption throughput, materials cache hit rates and ExternalUser ORM cost"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--mode",
+            nargs="+",
+            choices=EncryptionModeChoices.values,
+            default=EncryptionModeChoices.values,
+        )
+        parser.add_argument("--values", type=int, default=1000)
+        parser.add_argument("--rows", type=int, nargs="+", default=[1000, 100000])
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--skip-orm", action="store_true")
+
+    def handle(self, *args, **options):
+        if (
+            EncryptionModeChoices.ENVELOPE in options["mode"]
+            and settings.KMS_MASTER_KEY_PROVIDER == MasterKeyProviderChoices.LOCAL
+            and not settings.KMS_LOCAL_MASTER_KEY
+        ):
+            # data keys wrapped with a per process random master key are unusable elsewhere
+            raise CommandError(
+                "ENVELOPE mode with the LOCAL master key provider requires KMS_LOCAL_MASTER_KEY."
+            )
+
+        self.stdout.write(
+            f"master key provider: {settings.KMS_MASTER_KEY_PROVIDER}, "
+            f"cache capacity: {settings.KMS_CACHE_CAPACITY}, "
+            f"cache expiry: {settings.KMS_CACHE_EXPIRY}s"
+        )
+
+        encryption_mode = settings.KMS_ENCRYPTION_MODE
+        try:
+            with isolated_data_keys():
+                for mode in options["mode"]:
+                    settings.KMS_ENCRYPTION_MODE = mode
+                    self.stdout.write(self.style.MIGRATE_HEADING(f"{mode} mode"))
+                    self.benchmark_throughput(options["values"])
+                    if not options["skip_orm"]:
+                        for rows in options["rows"]:
+                            self.benchmark_orm(rows, options["batch_size"])
+        finally:
+            settings.KMS_ENCRYPTION_MODE = encryption_mode
+
+    def benchmark_throughput(self, count):
+        field = ExternalUser._meta.get_field("email")
+        values = [f"user-{index}@example.com" for index in range(count)]
+
+        with count_cache_lookups() as lookups:
+            started = time.perf_counter()
+            cipher_texts = [field.encrypt(value) for value in values]
+            encrypt_elapsed = time.perf_counter() - started
+
+            started = time.perf_counter()
+            for cipher_text in cipher_texts:
+                field.decrypt(cipher_text)
+            decrypt_elapsed = time.perf_counter() - started
+
+            started = time.perf_counter()
+            field.decrypt_many(cipher_texts)
+            decrypt_many_elapsed = time.perf_counter() - started
+
+        self.report("encrypt", count, encrypt_elapsed)
+        self.report("decrypt", count, decrypt_elapsed)
+        self.report("decrypt_many", count, decrypt_many_elapsed)
+        for operation in ("encryption", "decryption"):
+            hits = lookups[f"{operation}_hit"]
+            total = hits + lookups[f"{operation}_miss"]
+            if total:
+                self.stdout.write(
+                    f"  {operation} materials cache: {hits}/{total} hits "
+                    f"({hits / total:.1%})"
+                )
+
+    def benchmark_orm(self, rows, batch_size):
+        with transaction.atomic():
+            organization = Organization.objects.create(
+                clerk_org_id=f"benchmark_{uuid.uuid4()}",
+                name="benchmark",
+                slug=f"benchmark-{uuid.uuid4()}",
+            )
+
+            started = time.perf_counter()
+            for offset in range(0, rows, batch_size):
+                users = []
+                for index in range(offset, min(offset + batch_size, rows)):
+                    email = f"user-{index}@example.com"
+                    users.append(
+                        ExternalUser(
+                            organization=organization,
+                            external_id=str(index),
+                            first_name=f"First {index}",
+                            first_name_hash=utils.perform_hash(f"First {index}"),
+                            email=email,
+                            email_hash=utils.perform_hash(email),
+                        )
+                    )
+                ExternalUser.objects.bulk_create(users, batch_size=batch_size)
+            self.report(f"insert {rows} rows", rows, time.perf_counter() - started)
+
+            queryset = ExternalUser.objects.filter(organization=organization)
+
+            started = time.perf_counter()
+            for user in queryset.iterator(chunk_size=batch_size):
+                pass
+            self.report(
+                f"select {rows} rows (encrypted)", rows, time.perf_counter() - started
+            )
+
+            started = time.perf_counter()
+            for user in queryset.iterator(chunk_size=batch_size):
+                user.email
+                user.first_name
+            self.report(
+                f"select {rows} rows (lazy decrypt)",
+                rows,
+                time.perf_counter() - started,
+            )
+
+            started = time.perf_counter()
+            for user in queryset.decrypted().iterator(chunk_size=batch_size):
+                pass
+            self.report(
+                f"select {rows} rows (bulk decrypt)",
+                rows,
+                time.perf_counter() - started,
+            )
+
+            transaction.set_rollback(True)
+
+    def report(self, name, count, elapsed):
+        self.stdout.write(
+            f"  {name}: {elapsed:.3f}s, {count / elapsed if elapsed else 0:,.0f} ops/s"
+        )
+
+
+@contextlib.contextmanager
+def isolated_data_keys():
+    # data keys are created in a transaction that is rolled back, other processes
+    # never select them and nothing is left behind
+    create_data_key = fields.create_data_key
+    created = []
+
+    def create_uncommitted_data_key(field_type, master_key_id):
+        response = get_master_key_client().generate_data_key(
+            KeyId=master_key_id,
+            KeySpec="AES_256",
+            EncryptionContext={"field_type": field_type},
+        )
+        data_key = DataKey.objects.create(
+            field_type=field_type,
+            master_key_id=master_key_id,
+            wrapped_key=response["CiphertextBlob"],
+        )
+        created.append(data_key.id)
+        return data_key.id, data_key.created_at, response["Plaintext"]
+
+    fields.create_data_key = create_uncommitted_data_key
+    try:
+        with transaction.atomic():
+            yield
+            transaction.set_rollback(True)
+    finally:
+        fields.create_data_key = create_data_key
+        with fields.data_keys_lock:
+            for key_id in created:
+                fields.data_keys.pop(key_id, None)
+            for field_type, active in list(fields.active_data_keys.items()):
+                if active[0] in created:
+                    del fields.active_data_keys[field_type]
+
+
+@contextlib.contextmanager
+def count_cache_lookups():
+    lookups = Counter()
+
+    def wrap(operation, method):
+        def lookup(*args, **kwargs):
+            try:
+                materials = method(*args, **kwargs)
+            except CacheKeyError:
+                lookups[f"{operation}_miss"] += 1
+                raise
+            lookups[f"{operation}_hit"] += 1
+            return materials
+
+        return lookup
+
+    for operation in ("encryption", "decryption"):
+        method = f"get_{operation}_materials"
+        setattr(
+            fields.kms_cache, method, wrap(operation, getattr(fields.kms_cache, method))
+        )
+    try:
+        yield lookups
+    finally:
+        for operation in ("encryption", "decryption"):
+            delattr(fields.kms_cache, f"get_{operation}_materials")
@@ -0,0 +1,10 @@
+from django.db import models
+
+from whistle.fields import EncryptedFieldTypeChoices
+
+
+class DataKey(models.Model):
+    field_type = models.CharField(choices=EncryptedFieldTypeChoices.choices)
+    master_key_id = models.CharField()
+    wrapped_key = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
@@ -0,0 +1,150 @@
+import base64
+import unittest
+from unittest import mock
+
+from cryptography.exceptions import InvalidTag
+from django.test import TransactionTestCase
+
+from encryption.models import DataKey
+from external_user.models import ExternalUser
+from organization.models import Organization, OrganizationCredentials
+from whistle import fields, settings
+from whistle.kms import MasterKeyProviderChoices
+
+
+@unittest.skipUnless(
+    settings.KMS_MASTER_KEY_PROVIDER == MasterKeyProviderChoices.LOCAL,
+    "requires the LOCAL master key provider",
+)
+class EncryptedFieldTest(TransactionTestCase):
+    # data keys are committed on their own connection, so each test flushes the tables
+    def setUp(self):
+        fields.data_keys.clear()
+        fields.active_data_keys.clear()
+        self.org = Organization.objects.create(
+            clerk_org_id="org_test", name="Test", slug="test"
+        )
+        self.field = ExternalUser._meta.get_field("email")
+
+    def create_user(self, email):
+        return ExternalUser.objects.create(
+            organization=self.org,
+            external_id="user",
+            email=email,
+            email_hash="email_hash",
+        )
+
+    def get_stored_email(self, user):
+        # loaded values stay encrypted until the attribute is read
+        return ExternalUser.objects.get(pk=user.pk).__dict__["email"].cipher_text
+
+    def test_sdk_round_trip(self):
+        with mock.patch.object(
+            settings, "KMS_ENCRYPTION_MODE", fields.EncryptionModeChoices.SDK
+        ):
+            user = self.create_user("user@example.com")
+
+        stored = self.get_stored_email(user)
+        self.assertFalse(fields.is_envelope_cipher_text(stored))
+        self.assertNotIn("user@example.com", stored)
+        self.assertEqual(ExternalUser.objects.get(pk=user.pk).email, "user@example.com")
+        self.assertFalse(DataKey.objects.exists())
+
+    def test_envelope_round_trip(self):
+        with mock.patch.object(
+            settings, "KMS_ENCRYPTION_MODE", fields.EncryptionModeChoices.ENVELOPE
+        ):
+            user = self.create_user("user@example.com")
+            other = ExternalUser.objects.create(
+                organization=self.org,
+                external_id="other",
+                email="other@example.com",
+                email_hash="other_hash",
+            )
+
+        data_key = DataKey.objects.get()
+        self.assertEqual(
+            data_key.field_type, fields.EncryptedFieldTypeChoices.PERSONAL_DATA
+        )
+        for instance in [user, other]:
+            self.assertTrue(
+                self.get_stored_email(instance).startswith(
+                    f"{fields.ENVELOPE_PREFIX}{data_key.id}$"
+                )
+            )
+
+        # decryption unwraps the data key again instead of using the cached cipher
+        fields.data_keys.clear()
+        self.assertEqual(ExternalUser.objects.get(pk=user.pk).email, "user@example.com")
+        self.assertEqual(
+            list(
+                ExternalUser.objects.order_by("external_id").values_list(
+                    "email", flat=True
+                )
+            ),
+            ["other@example.com", "user@example.com"],
+        )
+
+    def test_encrypt_many_decrypt_many(self):
+        with mock.patch.object(
+            settings, "KMS_ENCRYPTION_MODE", fields.EncryptionModeChoices.SDK
+        ):
+            legacy = self.field.encrypt("legacy")
+        with mock.patch.object(
+            settings, "KMS_ENCRYPTION_MODE", fields.EncryptionModeChoices.ENVELOPE
+        ):
+            cipher_texts = self.field.encrypt_many(["a", "b", "a"])
+
+        # every value gets its own nonce
+        self.assertEqual(len(set(cipher_texts)), 3)
+        self.assertEqual(
+            self.field.decrypt_many([cipher_texts[1], legacy, *cipher_texts]),
+            ["b", "legacy", "a", "b", "a"],
+        )
+
+    def test_legacy_value_reencrypted_on_save(self):
+        with mock.patch.object(
+            settings, "KMS_ENCRYPTION_MODE", fields.EncryptionModeChoices.SDK
+        ):
+            user = self.create_user("user@example.com")
+            legacy = self.get_stored_email(user)
+
+            ExternalUser.objects.get(pk=user.pk).save()
+            self.assertEqual(self.get_stored_email(user), legacy)
+
+        with mock.patch.object(
+            settings, "KMS_ENCRYPTION_MODE", fields.EncryptionModeChoices.ENVELOPE
+        ):
+            ExternalUser.objects.get(pk=user.pk).save()
+            stored = self.get_stored_email(user)
+            self.assertTrue(fields.is_envelope_cipher_text(stored))
+
+            # envelope values are written back as is
+            ExternalUser.objects.get(pk=user.pk).save()
+            self.assertEqual(self.get_stored_email(user), stored)
+
+        self.assertEqual(ExternalUser.objects.get(pk=user.pk).email, "user@example.com")
+
+    def test_tampered_cipher_text(self):
+        with mock.patch.object(
+            settings, "KMS_ENCRYPTION_MODE", fields.EncryptionModeChoices.ENVELOPE
+        ):
+            cipher_text = self.field.encrypt("user@example.com")
+
+        prefix, payload = cipher_text.rsplit("$", 1)
+        payload = bytearray(base64.b64decode(payload))
+        payload[-1] ^= 1
+        tampered = f"{prefix}${base64.b64encode(bytes(payload)).decode()}"
+        with self.assertRaises(InvalidTag):
+            self.field.decrypt(tampered)
+
+    def test_wrong_field_type(self):
+        with mock.patch.object(
+            settings, "KMS_ENCRYPTION_MODE", fields.EncryptionModeChoices.ENVELOPE
+        ):
+            cipher_text = self.field.encrypt("user@example.com")
+
+        # the field type is bound as associated data, so values can't be moved across types
+        api_secret_field = OrganizationCredentials._meta.get_field("api_secret")
+        with self.assertRaises(InvalidTag):
+            api_secret_field.decrypt(cipher_text)
@@ -0,0 +1,90 @@
+# Generated by Django 5.0.6 on 2026-10-19 10:01
+
+import django.db.models.deletion
+import uuid
+import whistle.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("external_user", "0001_initial"),
+        ("organization", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ExternalUserImport",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                (
+                    "format",
+                    models.CharField(choices=[("NDJSON", "NDJSON"), ("CSV", "CSV")]),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("QUEUED", "QUEUED"),
+                            ("PROCESSING", "PROCESSING"),
+                            ("COMPLETED", "COMPLETED"),
+                        ]
+                    ),
+                ),
+                ("total_rows", models.IntegerField(default=0)),
+                ("processed_rows", models.IntegerField(default=0)),
+                ("failed_rows", models.IntegerField(default=0)),
+                ("total_chunks", models.IntegerField(default=0)),
+                ("processed_chunks", models.IntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("completed_at", models.DateTimeField(null=True)),
+                (
+                    "organization",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        to="organization.organization",
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="ExternalUserImportChunk",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                ("offset", models.IntegerField()),
+                (
+                    "rows",
+                    whistle.fields.EncryptedField(
+                        field_type="PERSONAL_DATA", null=True
+                    ),
+                ),
+                ("errors", models.JSONField(blank=True, null=True)),
+                ("processed_at", models.DateTimeField(null=True)),
+                (
+                    "user_import",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="chunks",
+                        to="external_user.externaluserimport",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-19 10:09
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # building the index without blocking writes to users
+    atomic = False
+
+    dependencies = [
+        ("external_user", "0002_external_user_import"),
+        ("organization", "0001_initial"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="externaluser",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["metadata"],
+                name="external_user_metadata_gin",
+                opclasses=["jsonb_path_ops"],
+            ),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.0.6 on 2026-10-19 10:27
+
+from django.db import migrations, models
+
+
+def mark_processed_chunks(apps, schema_editor):
+    ExternalUserImportChunk = apps.get_model("external_user", "ExternalUserImportChunk")
+    ExternalUserImportChunk.objects.filter(processed_at__isnull=False).update(
+        status="COMPLETED"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("external_user", "0003_external_user_metadata_gin"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="externaluserimport",
+            name="failed_chunks",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="externaluserimportchunk",
+            name="row_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="externaluserimportchunk",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("QUEUED", "QUEUED"),
+                    ("PROCESSING", "PROCESSING"),
+                    ("COMPLETED", "COMPLETED"),
+                    ("FAILED", "FAILED"),
+                ],
+                default="QUEUED",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="externaluserimport",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("QUEUED", "QUEUED"),
+                    ("PROCESSING", "PROCESSING"),
+                    ("COMPLETED", "COMPLETED"),
+                    ("FAILED", "FAILED"),
+                ]
+            ),
+        ),
+        migrations.RunPython(mark_processed_chunks, migrations.RunPython.noop),
+    ]
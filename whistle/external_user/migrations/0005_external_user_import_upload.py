@@ -0,0 +1,24 @@
+# Generated by Django 5.0.6 on 2026-10-19 10:51
+
+import whistle.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("external_user", "0004_external_user_import_failures"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="externaluserimport",
+            name="errors",
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="externaluserimport",
+            name="upload",
+            field=whistle.fields.EncryptedField(field_type="PERSONAL_DATA", null=True),
+        ),
+    ]
@@ -1,5 +1,6 @@
 import uuid
 
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 
 from organization.models import Organization
@@ -25,21 +26,31 @@ class ExternalUser(models.Model):
     phone_hash = models.CharField(null=True)
     metadata = models.JSONField(null=True, blank=True)
 
+    objects = fields.EncryptedQuerySet.as_manager()
+
     class Meta:
         unique_together = [
             ["organization", "email_hash"],
             ["organization", "phone_hash"],
             ["organization", "external_id"],
         ]
+        indexes = [
+            # serves the containment lookups audience filters compile to
+            GinIndex(
+                fields=["metadata"],
+                opclasses=["jsonb_path_ops"],
+                name="external_user_metadata_gin",
+            )
+        ]
 
     def save(self, *args, **kwargs):
-        if self.first_name:
+        if not fields.is_encrypted(self, "first_name") and self.first_name:
             self.first_name_hash = utils.perform_hash(self.first_name)
-        if self.last_name:
+        if not fields.is_encrypted(self, "last_name") and self.last_name:
             self.last_name_hash = utils.perform_hash(self.last_name)
-        if self.email:
+        if not fields.is_encrypted(self, "email") and self.email:
             self.email_hash = utils.perform_hash(self.email)
-        if self.phone:
+        if not fields.is_encrypted(self, "phone") and self.phone:
             self.phone_hash = utils.perform_hash(self.phone)
         super().save(*args, **kwargs)
 
@@ -54,3 +65,49 @@ class ExternalUserDevice(models.Model):
     user = models.ForeignKey(ExternalUser, on_delete=models.CASCADE)
     token = models.CharField(unique=True)
     platform = models.CharField(choices=PlatformChoices.choices)
+
+
+class ImportStatusChoices(models.TextChoices):
+    QUEUED = "QUEUED", "QUEUED"
+    PROCESSING = "PROCESSING", "PROCESSING"
+    COMPLETED = "COMPLETED", "COMPLETED"
+    FAILED = "FAILED", "FAILED"
+
+
+class ImportFormatChoices(models.TextChoices):
+    NDJSON = "NDJSON", "NDJSON"
+    CSV = "CSV", "CSV"
+
+
+class ExternalUserImport(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    organization = models.ForeignKey(Organization, on_delete=models.CASCADE)
+    format = models.CharField(choices=ImportFormatChoices.choices)
+    status = models.CharField(choices=ImportStatusChoices.choices)
+    total_rows = models.IntegerField(default=0)
+    processed_rows = models.IntegerField(default=0)
+    failed_rows = models.IntegerField(default=0)
+    total_chunks = models.IntegerField(default=0)
+    processed_chunks = models.IntegerField(default=0)
+    failed_chunks = models.IntegerField(default=0)
+    # the file is staged as uploaded and cleared once it is split into chunks
+    upload = fields.EncryptedField(EncryptedFieldTypeChoices.PERSONAL_DATA, null=True)
+    errors = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True)
+
+
+class ExternalUserImportChunk(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user_import = models.ForeignKey(
+        ExternalUserImport, related_name="chunks", on_delete=models.CASCADE
+    )
+    offset = models.IntegerField()
+    row_count = models.IntegerField(default=0)
+    status = models.CharField(
+        choices=ImportStatusChoices.choices, default=ImportStatusChoices.QUEUED
+    )
+    # staged rows are personal data and are cleared once the chunk is processed
+    rows = fields.EncryptedField(EncryptedFieldTypeChoices.PERSONAL_DATA, null=True)
+    errors = models.JSONField(null=True, blank=True)
+    processed_at = models.DateTimeField(null=True)
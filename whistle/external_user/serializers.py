@@ -1,17 +1,37 @@
 import logging
 
+from django.conf import settings
+from django.db import models
+from drf_spectacular.utils import extend_schema_field
 from rest_framework import serializers
 
 from external_user.models import (
     ExternalUser,
     ExternalUserDevice,
+    ExternalUserImport,
     PlatformChoices,
 )
+from whistle.auth import get_external_user
+from whistle.fields import decrypt_instances
+from whistle.fieldsets import SparseFieldsetSerializerMixin
 
 
-class ExternalUserSerializer(serializers.ModelSerializer):
+class ExternalUserListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        instances = list(data.all() if isinstance(data, models.Manager) else data)
+        decrypt_instances(
+            instances,
+            field_names={field.source for field in self.child._readable_fields},
+        )
+        return super().to_representation(instances)
+
+
+class ExternalUserSerializer(
+    SparseFieldsetSerializerMixin, serializers.ModelSerializer
+):
     class Meta:
         model = ExternalUser
+        list_serializer_class = ExternalUserListSerializer
         fields = [
             "id",
             "external_id",
@@ -40,6 +60,56 @@ class ExternalUserSerializer(serializers.ModelSerializer):
         return response
 
 
+class ExternalUserImportRowSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ExternalUser
+        fields = [
+            "external_id",
+            "first_name",
+            "last_name",
+            "email",
+            "phone",
+            "metadata",
+        ]
+
+
+class ExternalUserImportErrorSerializer(serializers.Serializer):
+    row = serializers.IntegerField()
+    code = serializers.CharField()
+    detail = serializers.JSONField()
+
+
+class ExternalUserImportSerializer(serializers.ModelSerializer):
+    errors = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExternalUserImport
+        fields = [
+            "id",
+            "format",
+            "status",
+            "total_rows",
+            "processed_rows",
+            "failed_rows",
+            "errors",
+            "created_at",
+            "completed_at",
+        ]
+
+    @extend_schema_field(ExternalUserImportErrorSerializer(many=True))
+    def get_errors(self, instance):
+        errors = list(instance.errors or [])
+        for chunk_errors in (
+            instance.chunks.filter(processed_at__isnull=False)
+            .order_by("offset")
+            .values_list("errors", flat=True)
+        ):
+            errors.extend(chunk_errors or [])
+            if len(errors) >= settings.EXTERNAL_USER_IMPORT_MAX_ERRORS:
+                break
+        return errors[: settings.EXTERNAL_USER_IMPORT_MAX_ERRORS]
+
+
 class ExternalUserDeviceSerializer(serializers.ModelSerializer):
     platform = serializers.CharField(max_length=255)
 
@@ -63,11 +133,7 @@ class ExternalUserDeviceSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         org = self.context["request"].user
-        external_id = self.context.get("external_id")
-        external_user = ExternalUser.objects.get(
-            organization=org, external_id=external_id
-        )
-        validated_data["user"] = external_user
+        validated_data["user"] = get_external_user(self.context["request"])
         response = super().create(validated_data)
         logging.info(
             "External user device with id: %s created for org: %s", response.id, org.id
@@ -0,0 +1,360 @@
+import csv
+import io
+import json
+import logging
+from datetime import datetime, timezone
+
+from celery.exceptions import MaxRetriesExceededError
+from celery.utils.time import get_exponential_backoff_interval
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import Case, F, Value, When
+
+from external_user.models import (
+    ExternalUser,
+    ExternalUserImport,
+    ExternalUserImportChunk,
+    ImportFormatChoices,
+    ImportStatusChoices,
+)
+from external_user.serializers import ExternalUserImportRowSerializer
+from whistle import utils
+from whistle.celery import app
+from whistle.fields import EncryptedValue
+
+hashed_fields = ["first_name", "last_name", "email", "phone"]
+
+
+@app.task(bind=True, ignore_result=True, queue="imports", max_retries=5)
+def stage_user_import(self, import_id):
+    try:
+        with transaction.atomic():
+            user_import = ExternalUserImport.objects.select_for_update().get(
+                pk=import_id
+            )
+            # redelivered tasks find the upload already split
+            if user_import.upload is None:
+                return
+            errors = []
+            try:
+                with transaction.atomic():
+                    chunk_ids = stage_import_chunks(user_import)
+            except csv.Error as error:
+                chunk_ids = []
+                errors.append(
+                    {
+                        "row": user_import.total_rows + 1,
+                        "code": "invalid_csv",
+                        "detail": f"Malformed CSV: {error}",
+                    }
+                )
+            if not chunk_ids and not errors:
+                errors.append(
+                    {
+                        "row": 1,
+                        "code": "empty_import",
+                        "detail": "The import file contains no rows.",
+                    }
+                )
+
+            user_import.upload = None
+            update_fields = ["upload", "total_rows", "total_chunks"]
+            if errors:
+                user_import.total_rows = user_import.total_chunks = 0
+                user_import.status = ImportStatusChoices.FAILED
+                user_import.errors = errors
+                user_import.completed_at = datetime.now(timezone.utc)
+                update_fields += ["status", "errors", "completed_at"]
+            user_import.save(update_fields=update_fields)
+            transaction.on_commit(
+                lambda: [
+                    process_user_import_chunk.delay(str(chunk_id))
+                    for chunk_id in chunk_ids
+                ]
+            )
+    except Exception as error:
+        try:
+            countdown = get_exponential_backoff_interval(
+                factor=settings.CELERY_RETRY_BACKOFF,
+                retries=self.request.retries,
+                maximum=settings.CELERY_BACKOFF_MAX,
+                full_jitter=settings.CELERY_RETRY_JITTER,
+            )
+            logging.warning(
+                "User import: %s failed to stage with error: %s", import_id, error
+            )
+            self.retry(countdown=countdown)
+        except MaxRetriesExceededError:
+            logging.error("Max retries reached staging user import: %s", import_id)
+            ExternalUserImport.objects.filter(pk=import_id).update(
+                upload=None,
+                status=ImportStatusChoices.FAILED,
+                errors=[
+                    {
+                        "row": 1,
+                        "code": "import_failed",
+                        "detail": "The import file could not be staged.",
+                    }
+                ],
+                completed_at=datetime.now(timezone.utc),
+            )
+        return
+
+    logging.info(
+        "User import: %s staged %s rows in %s chunks",
+        user_import.id,
+        user_import.total_rows,
+        user_import.total_chunks,
+    )
+
+
+def stage_import_chunks(user_import):
+    chunk_ids = []
+    rows = []
+    for row in read_import_rows(user_import.upload, user_import.format):
+        rows.append(row)
+        user_import.total_rows += 1
+        if len(rows) == settings.EXTERNAL_USER_IMPORT_CHUNK_SIZE:
+            chunk_ids.append(stage_import_chunk(user_import, rows))
+            rows = []
+    if rows:
+        chunk_ids.append(stage_import_chunk(user_import, rows))
+    user_import.total_chunks = len(chunk_ids)
+    return chunk_ids
+
+
+def read_import_rows(upload, format):
+    lines = io.StringIO(upload, newline="")
+    if format == ImportFormatChoices.CSV:
+        for row in csv.DictReader(lines):
+            # empty cells leave the stored value untouched
+            yield {key: value for key, value in row.items() if key and value}
+    else:
+        # ndjson lines are parsed with the rest of the row validation
+        for line in lines:
+            line = line.strip()
+            if line:
+                yield line
+
+
+def stage_import_chunk(user_import, rows):
+    chunk = ExternalUserImportChunk.objects.create(
+        user_import=user_import,
+        offset=user_import.total_rows - len(rows),
+        row_count=len(rows),
+        rows=json.dumps(rows),
+    )
+    return chunk.id
+
+
+@app.task(bind=True, ignore_result=True, queue="imports", max_retries=5)
+def process_user_import_chunk(self, chunk_id):
+    chunk = ExternalUserImportChunk.objects.select_related("user_import").get(
+        pk=chunk_id
+    )
+    if chunk.processed_at:
+        return
+
+    user_import = chunk.user_import
+    ExternalUserImport.objects.filter(
+        pk=user_import.pk, status=ImportStatusChoices.QUEUED
+    ).update(status=ImportStatusChoices.PROCESSING)
+
+    try:
+        rows = json.loads(chunk.rows)
+        users, errors = validate_import_rows(rows, chunk.offset, user_import.format)
+        errors += upsert_import_users(user_import.organization_id, users)
+    except Exception as error:
+        # upserts are idempotent so a retried chunk can be processed again from the start
+        try:
+            countdown = get_exponential_backoff_interval(
+                factor=settings.CELERY_RETRY_BACKOFF,
+                retries=self.request.retries,
+                maximum=settings.CELERY_BACKOFF_MAX,
+                full_jitter=settings.CELERY_RETRY_JITTER,
+            )
+            logging.warning(
+                "User import: %s failed to process chunk at offset: %s with error: %s",
+                user_import.id,
+                chunk.offset,
+                error,
+            )
+            self.retry(countdown=countdown)
+        except MaxRetriesExceededError:
+            logging.error(
+                "Max retries reached processing chunk at offset: %s of user import: %s",
+                chunk.offset,
+                user_import.id,
+            )
+            errors = [
+                {
+                    "row": chunk.offset + 1,
+                    "code": "chunk_failed",
+                    "detail": f"Rows {chunk.offset + 1} to {chunk.offset + chunk.row_count} could not be imported.",
+                }
+            ]
+            finish_import_chunk(
+                chunk,
+                chunk.row_count,
+                chunk.row_count,
+                errors,
+                ImportStatusChoices.FAILED,
+            )
+        return
+
+    errors.sort(key=lambda error: error["row"])
+    finish_import_chunk(
+        chunk, len(rows), len(errors), errors, ImportStatusChoices.COMPLETED
+    )
+    logging.info(
+        "User import: %s processed %s rows with %s errors from offset: %s",
+        user_import.id,
+        len(rows),
+        len(errors),
+        chunk.offset,
+    )
+
+
+def finish_import_chunk(chunk, row_count, failed_count, errors, status):
+    now = datetime.now(timezone.utc)
+    failed = status == ImportStatusChoices.FAILED
+    with transaction.atomic():
+        # redelivered tasks must not count the chunk twice
+        updated = ExternalUserImportChunk.objects.filter(
+            pk=chunk.pk, processed_at__isnull=True
+        ).update(rows=None, errors=errors, status=status, processed_at=now)
+        if not updated:
+            return
+        ExternalUserImport.objects.filter(pk=chunk.user_import_id).update(
+            processed_rows=F("processed_rows") + row_count,
+            failed_rows=F("failed_rows") + failed_count,
+            processed_chunks=F("processed_chunks") + 1,
+            failed_chunks=F("failed_chunks") + int(failed),
+        )
+        ExternalUserImport.objects.filter(
+            pk=chunk.user_import_id,
+            processed_chunks=F("total_chunks"),
+            status__in=[ImportStatusChoices.QUEUED, ImportStatusChoices.PROCESSING],
+        ).update(
+            status=Case(
+                When(failed_chunks__gt=0, then=Value(ImportStatusChoices.FAILED)),
+                default=Value(ImportStatusChoices.COMPLETED),
+            ),
+            completed_at=now,
+        )
+
+
+def validate_import_rows(rows, offset, format):
+    users = {}
+    errors = []
+    for index, row in enumerate(rows):
+        row_number = offset + index + 1
+        if isinstance(row, str):
+            try:
+                row = json.loads(row)
+            except ValueError:
+                row = None
+        if not isinstance(row, dict):
+            errors.append(
+                {
+                    "row": row_number,
+                    "code": "invalid_json",
+                    "detail": "Row is not a valid JSON object.",
+                }
+            )
+            continue
+        if format == ImportFormatChoices.CSV and "metadata" in row:
+            try:
+                row["metadata"] = json.loads(row["metadata"])
+            except ValueError:
+                pass
+
+        serializer = ExternalUserImportRowSerializer(data=row)
+        if not serializer.is_valid():
+            errors.append(
+                {
+                    "row": row_number,
+                    "code": "invalid_payload",
+                    "detail": flatten_errors(serializer.errors),
+                }
+            )
+            continue
+        # later rows for a user win, one upsert statement cannot touch a row twice
+        users[serializer.validated_data["external_id"]] = (
+            row_number,
+            serializer.validated_data,
+        )
+    return list(users.values()), errors
+
+
+def flatten_errors(errors):
+    if isinstance(errors, dict):
+        return {field: flatten_errors(value) for field, value in errors.items()}
+    if isinstance(errors, list) and len(errors) == 1:
+        return flatten_errors(errors[0])
+    return errors
+
+
+def upsert_import_users(org_id, users):
+    # rows setting the same fields are upserted together, omitted fields are kept
+    batches = {}
+    for row_number, data in users:
+        batches.setdefault(frozenset(data), []).append((row_number, data))
+
+    errors = []
+    for field_names, batch in batches.items():
+        instances = build_import_users(org_id, field_names, batch)
+        update_fields = [name for name in field_names if name != "external_id"]
+        update_fields += [
+            f"{name}_hash" for name in hashed_fields if name in field_names
+        ]
+        try:
+            with transaction.atomic():
+                bulk_upsert_users(instances, update_fields)
+        except IntegrityError:
+            # another unique constraint failed, isolate the offending rows
+            for (row_number, _), instance in zip(batch, instances):
+                try:
+                    with transaction.atomic():
+                        bulk_upsert_users([instance], update_fields)
+                except IntegrityError:
+                    errors.append(
+                        {
+                            "row": row_number,
+                            "code": "unique_constraint_error",
+                            "detail": "Another user in the organization has the same email or phone.",
+                        }
+                    )
+    return errors
+
+
+def bulk_upsert_users(instances, update_fields):
+    ExternalUser.objects.bulk_create(
+        instances,
+        update_conflicts=True,
+        unique_fields=["organization", "external_id"],
+        update_fields=update_fields,
+    )
+
+
+def build_import_users(org_id, field_names, batch):
+    instances = [ExternalUser(organization_id=org_id, **data) for _, data in batch]
+    for name in hashed_fields:
+        if name not in field_names:
+            continue
+        field = ExternalUser._meta.get_field(name)
+        pending = []
+        for instance in instances:
+            value = instance.__dict__[field.attname]
+            setattr(
+                instance, f"{name}_hash", utils.perform_hash(value) if value else None
+            )
+            if value:
+                pending.append(instance)
+        # one batched encryption per field instead of one per value
+        cipher_texts = field.encrypt_many(
+            [instance.__dict__[field.attname] for instance in pending]
+        )
+        for instance, cipher_text in zip(pending, cipher_texts):
+            instance.__dict__[field.attname] = EncryptedValue(cipher_text, field)
+    return instances
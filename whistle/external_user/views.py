@@ -1,8 +1,11 @@
 import logging
 
+from django.conf import settings
 from django.db import transaction
+from drf_spectacular.types import OpenApiTypes
 from drf_spectacular.utils import extend_schema
-from rest_framework import status
+from rest_framework import mixins, status
+from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.settings import api_settings
@@ -11,33 +14,74 @@ from rest_framework.viewsets import ModelViewSet, GenericViewSet
 from external_user.models import (
     ExternalUser,
     ExternalUserDevice,
+    ExternalUserImport,
+    ImportFormatChoices,
+    ImportStatusChoices,
 )
 from external_user.serializers import (
     ExternalUserSerializer,
     ExternalUserDeviceSerializer,
+    ExternalUserImportSerializer,
 )
+from external_user.tasks import stage_user_import
 from whistle.auth import (
     ServerAuth,
     ClientAuth,
     IsValidExternalId,
+    get_external_user,
+    invalidate_external_user,
 )
+from whistle.exports import export_response, export_response_schema
+from whistle.fieldsets import SparseFieldsetMixin
 from whistle.pagination import StandardLimitOffsetPagination
 
 
-class ExternalUserImportViewSet(GenericViewSet):
-    queryset = ExternalUser.objects.all()
+import_formats = {
+    "application/x-ndjson": ImportFormatChoices.NDJSON,
+    "application/jsonl": ImportFormatChoices.NDJSON,
+    "text/csv": ImportFormatChoices.CSV,
+}
+
+
+class ExternalUserImportViewSet(mixins.RetrieveModelMixin, GenericViewSet):
+    queryset = ExternalUserImport.objects.all()
     serializer_class = ExternalUserSerializer
     authentication_classes = [ServerAuth]
 
+    def get_queryset(self):
+        return self.queryset.filter(organization=self.request.user)
+
+    def get_serializer_class(self):
+        if self.action == "retrieve":
+            return ExternalUserImportSerializer
+        return self.serializer_class
+
     @extend_schema(
-        request=ExternalUserSerializer(many=True),
-        responses={201: ExternalUserSerializer(many=True)},
+        request={
+            "application/json": ExternalUserSerializer(many=True),
+            "application/x-ndjson": OpenApiTypes.BINARY,
+            "text/csv": OpenApiTypes.BINARY,
+        },
+        responses={
+            201: ExternalUserSerializer(many=True),
+            202: ExternalUserImportSerializer,
+        },
     )
-    @transaction.atomic
     def create(self, request, *args, **kwargs):
-        serializer = self.get_serializer(data=request.data, many=True)
-        serializer.is_valid(raise_exception=True)
-        self.perform_create(serializer)
+        # files are staged as uploaded and imported in the background
+        content_type = request.content_type.split(";")[0].strip()
+        if content_type in import_formats:
+            return self.create_import(request._request, import_formats[content_type])
+        if content_type == "multipart/form-data" and "file" in request.FILES:
+            upload = request.FILES["file"]
+            if upload.name.endswith(".csv") or upload.content_type == "text/csv":
+                return self.create_import(upload, ImportFormatChoices.CSV)
+            return self.create_import(upload, ImportFormatChoices.NDJSON)
+
+        with transaction.atomic():
+            serializer = self.get_serializer(data=request.data, many=True)
+            serializer.is_valid(raise_exception=True)
+            self.perform_create(serializer)
         headers = self.get_success_headers(serializer.data)
         return Response(
             serializer.data, status=status.HTTP_201_CREATED, headers=headers
@@ -46,6 +90,31 @@ class ExternalUserImportViewSet(GenericViewSet):
     def perform_create(self, serializer):
         serializer.save()
 
+    def create_import(self, source, format):
+        org = self.request.user
+        try:
+            upload = source.read().decode("utf-8-sig")
+        except UnicodeDecodeError:
+            raise ValidationError(
+                "Import files must be UTF-8 encoded.", "invalid_encoding"
+            )
+        if not upload.strip():
+            raise ValidationError("The import file contains no rows.", "empty_import")
+
+        # the upload is split into chunks by the first background task
+        with transaction.atomic():
+            user_import = ExternalUserImport.objects.create(
+                organization=org,
+                format=format,
+                status=ImportStatusChoices.QUEUED,
+                upload=upload,
+            )
+            transaction.on_commit(lambda: stage_user_import.delay(str(user_import.id)))
+
+        logging.info("User import: %s queued for org: %s", user_import.id, org.id)
+        serializer = ExternalUserImportSerializer(user_import)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
     def get_success_headers(self, data):
         try:
             return {"Location": str(data[api_settings.URL_FIELD_NAME])}
@@ -53,7 +122,7 @@ class ExternalUserImportViewSet(GenericViewSet):
             return {}
 
 
-class ExternalUserViewSet(ModelViewSet):
+class ExternalUserViewSet(SparseFieldsetMixin, ModelViewSet):
     queryset = ExternalUser.objects.all()
     serializer_class = ExternalUserSerializer
     authentication_classes = [ServerAuth]
@@ -62,6 +131,32 @@ class ExternalUserViewSet(ModelViewSet):
     def get_queryset(self):
         return self.queryset.filter(organization=self.request.user)
 
+    @extend_schema(responses=export_response_schema)
+    @action(methods=["GET"], detail=False)
+    def export(self, request, **kwargs):
+        # a server side cursor keeps memory flat, values are decrypted per chunk
+        serializer = ExternalUserSerializer()
+        users = (
+            self.get_queryset()
+            .order_by("pk")
+            .decrypted()
+            .iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+        )
+        return export_response(
+            request, (serializer.to_representation(user) for user in users), "users"
+        )
+
+    def perform_update(self, serializer):
+        external_id = serializer.instance.external_id
+        super().perform_update(serializer)
+        # after the write, so a concurrent lookup can't cache the old row again
+        invalidate_external_user(self.request.user.id, external_id)
+
+    def perform_destroy(self, instance):
+        external_id = instance.external_id
+        super().perform_destroy(instance)
+        invalidate_external_user(self.request.user.id, external_id)
+
 
 class DeviceViewSet(ModelViewSet):
     queryset = ExternalUserDevice.objects.all()
@@ -70,25 +165,5 @@ class DeviceViewSet(ModelViewSet):
     permission_classes = [IsValidExternalId]
 
     def get_queryset(self):
-        external_id = self.request.headers.get("X-External-Id")
-        try:
-            user = ExternalUser.objects.get(
-                external_id=external_id,
-                organization=self.request.user,
-            )
-        except ExternalUser.DoesNotExist:
-            logging.error(
-                "Invalid external id: %s provided for org: %s while querying preferences",
-                external_id,
-                self.request.user.id,
-            )
-            raise ValidationError(
-                "Invalid External Id. Please provide a valid External Id in the request header.",
-                "invalid_external_id",
-            )
+        user = get_external_user(self.request)
         return self.queryset.filter(user=user)
-
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        context.update({"external_id": self.request.headers.get("X-External-Id")})
-        return context
@@ -0,0 +1,145 @@
+import json
+import logging
+import uuid
+from datetime import datetime, timezone
+
+from notification.models import Notification
+from whistle.cache import redis_client, async_redis_client
+
+ENGAGEMENT_EVENTS_KEY = "engagement:events"
+
+engagement_fields = {
+    "seen_at",
+    "read_at",
+    "clicked_at",
+}
+
+# read_at is not buffered, a flush must not re-apply a read the user has since undone
+buffered_engagement_fields = {
+    "seen_at",
+    "clicked_at",
+}
+
+
+def build_engagement_events(org_id, recipient_id, notification_ids, field):
+    if field not in buffered_engagement_fields:
+        raise ValueError(f"'{field}' is not a buffered engagement field.")
+
+    at = datetime.now(timezone.utc).isoformat()
+    return [
+        json.dumps(
+            {
+                # raises for anything that is not a notification id before it is buffered
+                "notification_id": str(uuid.UUID(str(notification_id))),
+                "org_id": str(org_id),
+                "recipient_id": str(recipient_id),
+                "field": field,
+                "at": at,
+            }
+        )
+        for notification_id in notification_ids
+    ]
+
+
+def buffer_engagement_events(org_id, recipient_id, notification_ids, field):
+    events = build_engagement_events(org_id, recipient_id, notification_ids, field)
+    if events:
+        redis_client.rpush(ENGAGEMENT_EVENTS_KEY, *events)
+        logging.debug(
+            "Buffered %s %s events for user: %s in org: %s",
+            len(events),
+            field,
+            recipient_id,
+            org_id,
+        )
+    return len(events)
+
+
+async def abuffer_engagement_events(org_id, recipient_id, notification_ids, field):
+    events = build_engagement_events(org_id, recipient_id, notification_ids, field)
+    if events:
+        await async_redis_client.rpush(ENGAGEMENT_EVENTS_KEY, *events)
+        logging.debug(
+            "Buffered %s %s events for user: %s in org: %s",
+            len(events),
+            field,
+            recipient_id,
+            org_id,
+        )
+    return len(events)
+
+
+# a redelivered flush finds the events it claimed before the worker was lost
+claim_engagement_events_lua = """
+    local events = redis.call('LRANGE', KEYS[2], 0, -1)
+    if #events > 0 then
+        return events
+    end
+    events = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+    if #events > 0 then
+        redis.call('LTRIM', KEYS[1], #events, -1)
+        redis.call('RPUSH', KEYS[2], unpack(events))
+    end
+    return events
+"""
+
+restore_engagement_events_lua = """
+    while redis.call('LMOVE', KEYS[2], KEYS[1], 'RIGHT', 'LEFT') do
+    end
+    return 0
+"""
+
+
+def get_engagement_processing_key(task_id):
+    return f"engagement:processing:{task_id}"
+
+
+def claim_engagement_events(processing_key, count):
+    # events stay in the processing list until they are persisted
+    return redis_client.eval(
+        claim_engagement_events_lua,
+        2,
+        ENGAGEMENT_EVENTS_KEY,
+        processing_key,
+        count,
+    )
+
+
+def ack_engagement_events(processing_key):
+    redis_client.delete(processing_key)
+
+
+def restore_engagement_events(processing_key):
+    redis_client.eval(
+        restore_engagement_events_lua, 2, ENGAGEMENT_EVENTS_KEY, processing_key
+    )
+
+
+def coalesce_engagement_events(events):
+    # keep the earliest timestamp per notification and field so the first engagement wins
+    coalesced = {}
+    for raw_event in events:
+        event = json.loads(raw_event)
+        # events for the same notification from another recipient must not displace the owner's
+        key = (
+            event["field"],
+            event["notification_id"],
+            event["org_id"],
+            event["recipient_id"],
+        )
+        at = datetime.fromisoformat(event["at"])
+        if key not in coalesced or at < coalesced[key]["at"]:
+            coalesced[key] = {**event, "at": at}
+    return coalesced.values()
+
+
+def update_engagement(org_id, recipient_id, notification_ids, field):
+    if field not in engagement_fields:
+        raise ValueError(f"'{field}' is not an engagement field.")
+
+    return Notification.objects.filter(
+        pk__in=notification_ids,
+        organization_id=org_id,
+        recipient_id=recipient_id,
+        **{f"{field}__isnull": True},
+    ).update(**{field: datetime.now(timezone.utc)})
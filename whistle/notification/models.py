@@ -48,6 +48,11 @@ class Notification(models.Model):
     archived_at = models.DateTimeField(null=True)
 
 
+def get_notification_id(broadcast_id, recipient_id):
+    # derivable without a lookup, so group published events can be resolved per user
+    return uuid.uuid5(broadcast_id, str(recipient_id))
+
+
 class DeliveryStatusChoices(models.TextChoices):
     DELIVERED = "DELIVERED", "DELIVERED"
     ATTEMPTED = "ATTEMPTED", "ATTEMPTED"
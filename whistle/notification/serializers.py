@@ -10,6 +10,7 @@ from notification.models import (
 )
 from preference.models import ChannelChoices
 from provider.models import Provider, ProviderTypeChoices
+from whistle.fieldsets import SparseFieldsetSerializerMixin
 
 
 class NotificationDeliverySerializer(serializers.ModelSerializer):
@@ -90,7 +91,7 @@ class BroadcastRecipientSerializer(serializers.Serializer):
         return data
 
 
-class BroadcastSerializer(serializers.ModelSerializer):
+class BroadcastSerializer(SparseFieldsetSerializerMixin, serializers.ModelSerializer):
     title = serializers.CharField()
     content = serializers.CharField()
     action_link = serializers.CharField(required=False)
@@ -234,7 +235,9 @@ class BroadcastSerializer(serializers.ModelSerializer):
         return instance
 
 
-class NotificationSerializer(serializers.ModelSerializer):
+class NotificationSerializer(
+    SparseFieldsetSerializerMixin, serializers.ModelSerializer
+):
     deliveries = NotificationDeliverySerializer(read_only=True, many=True)
     broadcast = BroadcastSerializer(read_only=True)
     recipient = ExternalUserSerializer(read_only=True)
@@ -272,3 +275,32 @@ class InboxSerializer(serializers.ModelSerializer):
 
 class NotificationStatusSerializer(serializers.Serializer):
     pass
+
+
+class ExportFilterSerializer(serializers.Serializer):
+    broadcast = serializers.UUIDField(required=False)
+
+
+class InboxBulkUpdateSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.UUIDField(),
+        required=False,
+        allow_empty=False,
+        max_length=settings.MAX_INBOX_BULK_UPDATE_IDS,
+    )
+    before = serializers.DateTimeField(required=False)
+    all = serializers.BooleanField(required=False, default=False)
+
+    def validate(self, data):
+        selectors = [
+            selector for selector in ["ids", "before"] if data.get(selector) is not None
+        ]
+        if data.get("all"):
+            selectors.append("all")
+
+        if len(selectors) != 1:
+            raise serializers.ValidationError(
+                "Exactly one of 'ids', 'before' or 'all' must be provided to select the notifications to update.",
+                "invalid_bulk_selector",
+            )
+        return data
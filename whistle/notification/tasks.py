@@ -1,4 +1,5 @@
 import logging
+import math
 import uuid
 from datetime import datetime, timezone
 
@@ -8,7 +9,7 @@ from celery.exceptions import MaxRetriesExceededError
 from celery.utils.time import get_exponential_backoff_interval
 from channels.layers import get_channel_layer
 from django.conf import settings
-from django.db.models import Q
+from django.db.models import Q, Case, When, Value, F, DateTimeField
 from pyapns_client import (
     IOSPayloadAlert,
     IOSPayload,
@@ -31,13 +32,25 @@ from sendgrid import (
 from twilio.base.exceptions import TwilioRestException
 from twilio.rest import Client
 
-from audience.models import Audience, OperatorChoices
+from audience.models import (
+    Audience,
+    MetadataKey,
+    MetadataKeyTypeChoices,
+    OperatorChoices,
+)
 from provider.models import (
     Provider,
     ProviderTypeChoices,
     ProviderChoices,
 )
 from external_user.models import ExternalUser, ExternalUserDevice, PlatformChoices
+from notification.engagement import (
+    ack_engagement_events,
+    claim_engagement_events,
+    coalesce_engagement_events,
+    get_engagement_processing_key,
+    restore_engagement_events,
+)
 from notification.models import (
     Notification,
     Broadcast,
@@ -45,10 +58,28 @@ from notification.models import (
     DeliveryStatusChoices,
     NotificationStatusChoices,
     BroadcastStatusChoices,
+    get_notification_id,
+)
+from preference.models import (
+    ExternalUserPreference,
+    ExternalUserPreferenceChannel,
+    ChannelChoices,
+)
+from realtime.events import (
+    append_events,
+    BROADCAST_PUBLISHED,
+    append_group_event,
+    get_broadcast_marker_key,
+)
+from realtime.groups import get_user_group, get_org_group, get_topic_group
+from realtime.presence import is_online, get_online_user_ids
+from realtime.publisher import group_send_many
+from subscription.models import (
+    ExternalUserSubscription,
+    ExternalUserSubscriptionCategory,
 )
-from preference.models import ExternalUserPreference, ChannelChoices
-from subscription.models import ExternalUserSubscription
 from whistle import utils
+from whistle.cache import redis_client
 from whistle.celery import app
 from whistle.client import CustomAPNSClient, CustomFCMNotification
 from whistle.exceptions import NotificationException
@@ -60,6 +91,19 @@ basic_fields = {
     "last_name",
 }
 
+metadata_comparison_lookups = {
+    OperatorChoices.GT: "gt",
+    OperatorChoices.LT: "lt",
+    OperatorChoices.GTE: "gte",
+    OperatorChoices.LTE: "lte",
+}
+
+metadata_json_types = {
+    MetadataKeyTypeChoices.STRING: "string",
+    MetadataKeyTypeChoices.NUMBER: "number",
+    MetadataKeyTypeChoices.BOOLEAN: "boolean",
+}
+
 
 @app.task(bind=True, ignore_result=True, queue="broadcasts")
 def send_broadcast(self, broadcast_id, org_id, data):
@@ -69,18 +113,39 @@ def send_broadcast(self, broadcast_id, org_id, data):
     org_id = uuid.UUID(org_id)
 
     recipient_ids = set()
+    org_wide = False
 
     redacted_data = data.copy()
     redacted_data.update({"recipients": "***"})
     redacted_data.update({"merge_tags": "***"})
 
+    # in app delivery is fanned out in batches instead of one task per recipient
+    in_app_recipients = []
+    batch_in_app = ChannelChoices.IN_APP.value in data["channels"]
+    recipient_data = data
+    if batch_in_app:
+        recipient_data = {
+            **data,
+            "channels": [
+                channel
+                for channel in data["channels"]
+                if channel != ChannelChoices.IN_APP.value
+            ],
+        }
+
     if "audience_id" in data:
         audience = Audience.objects.prefetch_related("filters").filter(
             organization_id=org_id, id=data["audience_id"]
         )
         filters = audience.first().filters.all()
-        filter_kwargs = build_filter_kwargs(filters)
-        exclude_kwargs = build_exclude_kwargs(filters)
+        org_wide = not filters
+        metadata_keys = dict(
+            MetadataKey.objects.filter(organization_id=org_id).values_list(
+                "key", "type"
+            )
+        )
+        filter_kwargs = build_filter_kwargs(filters, metadata_keys)
+        exclude_kwargs = build_exclude_kwargs(filters, metadata_keys)
 
         recipients = ExternalUser.objects.filter(
             organization_id=org_id, **filter_kwargs
@@ -103,11 +168,18 @@ def send_broadcast(self, broadcast_id, org_id, data):
                     broadcast_id,
                 )
                 continue
-            tasks.append(
-                send_recipient.s(
-                    broadcast_id, org_id, recipient.id, notification.id, data=data
-                ).set(kwargsrepr=repr({"data": redacted_data}))
-            )
+            if batch_in_app:
+                in_app_recipients.append([recipient.id, notification.id, None])
+            if recipient_data["channels"]:
+                tasks.append(
+                    send_recipient.s(
+                        broadcast_id,
+                        org_id,
+                        recipient.id,
+                        notification.id,
+                        data=recipient_data,
+                    ).set(kwargsrepr=repr({"data": redacted_data}))
+                )
             recipient_ids.add(recipient.id)
 
     if "recipients" in data:
@@ -133,15 +205,20 @@ def send_broadcast(self, broadcast_id, org_id, data):
                             broadcast_id,
                         )
                         continue
-                    tasks.append(
-                        send_recipient.s(
-                            broadcast_id,
-                            org_id,
-                            recipient_entity.id,
-                            notification.id,
-                            data=data,
-                        ).set(kwargsrepr=repr({"data": redacted_data}))
-                    )
+                    if batch_in_app:
+                        in_app_recipients.append(
+                            [recipient_entity.id, notification.id, None]
+                        )
+                    if recipient_data["channels"]:
+                        tasks.append(
+                            send_recipient.s(
+                                broadcast_id,
+                                org_id,
+                                recipient_entity.id,
+                                notification.id,
+                                data=recipient_data,
+                            ).set(kwargsrepr=repr({"data": redacted_data}))
+                        )
                     recipient_ids.add(recipient_entity.id)
 
     if "topic" in data:
@@ -167,13 +244,48 @@ def send_broadcast(self, broadcast_id, org_id, data):
                         broadcast_id,
                     )
                     continue
-                tasks.append(
-                    send_subscriber.s(
-                        broadcast_id, org_id, subscriber.id, notification.id, data=data
-                    ).set(kwargsrepr=repr({"data": redacted_data}))
-                )
+                if batch_in_app:
+                    in_app_recipients.append(
+                        [subscriber.user.id, notification.id, subscriber.id]
+                    )
+                if recipient_data["channels"]:
+                    tasks.append(
+                        send_subscriber.s(
+                            broadcast_id,
+                            org_id,
+                            subscriber.id,
+                            notification.id,
+                            data=recipient_data,
+                        ).set(kwargsrepr=repr({"data": redacted_data}))
+                    )
                 recipient_ids.add(subscriber.user.id)
 
+    group = get_broadcast_group(org_id, data, org_wide) if in_app_recipients else None
+    in_app_tasks = [
+        send_in_app_batch.s(
+            broadcast_id,
+            org_id,
+            in_app_recipients[offset : offset + settings.IN_APP_BATCH_SIZE],
+            data=data,
+            # without other channels no per recipient task marks the notification processed
+            finalize=not recipient_data["channels"],
+            publish=not group,
+        ).set(kwargsrepr=repr({"data": redacted_data}))
+        for offset in range(0, len(in_app_recipients), settings.IN_APP_BATCH_SIZE)
+    ]
+    if group:
+        # one publish reaches every connected member once the batches created their inbox entries
+        tasks.append(
+            chord(
+                in_app_tasks,
+                publish_broadcast.si(broadcast_id, org_id, group, data=data).set(
+                    kwargsrepr=repr({"data": redacted_data})
+                ),
+            )
+        )
+    else:
+        tasks.extend(in_app_tasks)
+
     if "schedule_at" in data:
         entry = RedBeatSchedulerEntry.from_key(
             f"redbeat:broadcast_{broadcast_id}", app=app
@@ -187,6 +299,60 @@ def send_broadcast(self, broadcast_id, org_id, data):
     return
 
 
+@app.task(bind=True, ignore_result=True, queue="outbound", max_retries=5)
+def publish_broadcast(self, broadcast_id, org_id, group, data):
+    # a retried broadcast queues this again, the marker keeps it to one publish and
+    # holds the logged event id so a retried send doesn't log the event twice
+    marker_key = get_broadcast_marker_key(broadcast_id)
+    try:
+        marker = redis_client.get(marker_key)
+        if marker == BROADCAST_PUBLISHED:
+            logging.info(
+                "Broadcast: %s already published to group: %s", broadcast_id, group
+            )
+            return
+
+        message = {
+            "type": "broadcast.created",
+            "broadcast_id": str(broadcast_id),
+            "event": build_in_app_event(None, data),
+        }
+        if marker:
+            message["event_id"] = marker.decode()
+        else:
+            message = append_group_event(group, message)
+            if "event_id" in message:
+                redis_client.set(
+                    marker_key, message["event_id"], ex=settings.REALTIME_EVENT_LOG_TTL
+                )
+        async_to_sync(get_channel_layer().group_send)(group, message)
+        redis_client.set(
+            marker_key, BROADCAST_PUBLISHED, ex=settings.REALTIME_EVENT_LOG_TTL
+        )
+    except Exception as e:
+        try:
+            countdown = get_exponential_backoff_interval(
+                factor=settings.CELERY_RETRY_BACKOFF,
+                retries=self.request.retries,
+                maximum=settings.CELERY_BACKOFF_MAX,
+                full_jitter=settings.CELERY_RETRY_JITTER,
+            )
+            self.retry(countdown=countdown)
+        except MaxRetriesExceededError:
+            logging.error(
+                "Max retries reached trying to publish broadcast: %s to group: %s",
+                broadcast_id,
+                group,
+            )
+        return
+
+    logging.info(
+        "In app notification published to group: %s for broadcast: %s",
+        group,
+        broadcast_id,
+    )
+
+
 @app.task(bind=True, ignore_result=True, queue="notifications")
 def send_recipient(self, broadcast_id, org_id, recipient_id, notification_id, data):
     recipient = ExternalUser.objects.get(pk=recipient_id)
@@ -397,23 +563,13 @@ def send_in_app(self, broadcast_id, org_id, user_id, notification_id, data):
         content = data["content"]
         action_link = data.get("action_link")
 
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f"user_{user_id}",
-            {
-                "object": "event",
-                "type": "notification.created",
-                "data": {
-                    "id": str(notification_id),
-                    "category": data.get("category", ""),
-                    "topic": data.get("topic", ""),
-                    "title": title,
-                    "content": content,
-                    "action_link": action_link,
-                    "additional_info": data.get("additional_info", {}),
-                },
-            },
-        )
+        # offline users pick the notification up from their inbox
+        if is_online(user_id):
+            [(_, event)] = append_events(
+                [(user_id, build_in_app_event(notification_id, data))]
+            )
+            channel_layer = get_channel_layer()
+            async_to_sync(channel_layer.group_send)(get_user_group(user_id), event)
 
         persist_notification_delivery(
             notification_id,
@@ -447,6 +603,137 @@ def send_in_app(self, broadcast_id, org_id, user_id, notification_id, data):
             )
 
 
+@app.task(bind=True, ignore_result=True, queue="outbound", max_retries=5)
+def send_in_app_batch(
+    self, broadcast_id, org_id, recipients, data, finalize=False, publish=True
+):
+    notification_ids = [notification_id for _, notification_id, _ in recipients]
+    delivered = set(
+        NotificationDelivery.objects.filter(
+            notification_id__in=notification_ids,
+            channel=ChannelChoices.IN_APP.value,
+            status__in=[
+                DeliveryStatusChoices.DELIVERED,
+                DeliveryStatusChoices.NOT_SENT,
+            ],
+        ).values_list("notification_id", flat=True)
+    )
+    pending = [
+        (uuid.UUID(str(user_id)), uuid.UUID(str(notification_id)), subscriber_id)
+        for user_id, notification_id, subscriber_id in recipients
+        if uuid.UUID(str(notification_id)) not in delivered
+    ]
+
+    disabled = set()
+    if "category" in data and pending:
+        subscriber_ids = [
+            subscriber_id for _, _, subscriber_id in pending if subscriber_id
+        ]
+        enabled_subscriber_ids = set(
+            ExternalUserSubscriptionCategory.objects.filter(
+                user_subscription_id__in=subscriber_ids,
+                slug=data["category"],
+                enabled=True,
+            ).values_list("user_subscription_id", flat=True)
+        )
+        # subscribers without the category enabled are not routed at all
+        pending = [
+            (user_id, notification_id, subscriber_id)
+            for user_id, notification_id, subscriber_id in pending
+            if not subscriber_id
+            or uuid.UUID(str(subscriber_id)) in enabled_subscriber_ids
+        ]
+        disabled = set(
+            ExternalUserPreferenceChannel.objects.filter(
+                user_preference__user_id__in=[user_id for user_id, _, _ in pending],
+                user_preference__slug=data["category"],
+                slug=ChannelChoices.IN_APP.value,
+                enabled=False,
+            ).values_list("user_preference__user_id", flat=True)
+        )
+
+    deliver = [
+        (user_id, notification_id)
+        for user_id, notification_id, _ in pending
+        if user_id not in disabled
+    ]
+    not_sent = [
+        (user_id, notification_id)
+        for user_id, notification_id, _ in pending
+        if user_id in disabled
+    ]
+
+    online_user_ids = set()
+    try:
+        # group published broadcasts only persist the inbox here
+        if publish:
+            online_user_ids = get_online_user_ids(user_id for user_id, _ in deliver)
+            events = append_events(
+                [
+                    (user_id, build_in_app_event(notification_id, data))
+                    for user_id, notification_id in deliver
+                    if user_id in online_user_ids
+                ]
+            )
+            async_to_sync(group_send_many)(
+                get_channel_layer(),
+                [(get_user_group(user_id), event) for user_id, event in events],
+            )
+    except Exception as e:
+        try:
+            countdown = get_exponential_backoff_interval(
+                factor=settings.CELERY_RETRY_BACKOFF,
+                retries=self.request.retries,
+                maximum=settings.CELERY_BACKOFF_MAX,
+                full_jitter=settings.CELERY_RETRY_JITTER,
+            )
+            self.retry(countdown=countdown)
+        except MaxRetriesExceededError:
+            logging.error(
+                "Max retries reached trying to send batched in app notifications for %s users in broadcast: %s",
+                len(deliver),
+                broadcast_id,
+            )
+            persist_notification_deliveries(
+                [notification_id for _, notification_id in deliver],
+                channel=ChannelChoices.IN_APP,
+                status=DeliveryStatusChoices.UNDELIVERED,
+            )
+            return
+
+    persist_notification_deliveries(
+        [notification_id for _, notification_id in deliver],
+        data["title"],
+        data["content"],
+        data.get("action_link"),
+        channel=ChannelChoices.IN_APP,
+        status=DeliveryStatusChoices.DELIVERED,
+    )
+    persist_notification_deliveries(
+        [notification_id for _, notification_id in not_sent],
+        data["title"],
+        data["content"],
+        data.get("action_link"),
+        channel=ChannelChoices.IN_APP,
+        status=DeliveryStatusChoices.NOT_SENT,
+        error_reason="User disabled",
+    )
+
+    if finalize:
+        Notification.objects.filter(
+            pk__in=[notification_id for _, notification_id, _ in pending]
+        ).update(status=NotificationStatusChoices.PROCESSED)
+
+    logging.info(
+        "Batched in app notifications sent to %s users (%s online, %s disabled) in org: %s for broadcast: %s",
+        len(deliver),
+        len(online_user_ids),
+        len(not_sent),
+        org_id,
+        broadcast_id,
+    )
+
+
 @app.task(bind=True, ignore_result=True, queue="outbound", max_retries=5)
 def send_push(
     self,
@@ -584,6 +871,72 @@ def send_recipient_callback(self, notification_id, status):
     return
 
 
+@app.task(bind=True, ignore_result=True, queue="notifications")
+def flush_engagement_events(self):
+    processing_key = get_engagement_processing_key(self.request.id)
+    for _ in range(settings.ENGAGEMENT_FLUSH_MAX_BATCHES):
+        events = claim_engagement_events(
+            processing_key, settings.ENGAGEMENT_FLUSH_BATCH_SIZE
+        )
+        if not events:
+            return
+        try:
+            updated = persist_engagement_events(coalesce_engagement_events(events))
+        except Exception as error:
+            restore_engagement_events(processing_key)
+            logging.error(
+                "Failed to flush %s engagement events with error: %s",
+                len(events),
+                error,
+            )
+            raise
+        ack_engagement_events(processing_key)
+        logging.info(
+            "Flushed %s engagement events updating %s notifications",
+            len(events),
+            updated,
+        )
+
+
+def persist_engagement_events(events):
+    events_by_field = {}
+    for event in events:
+        events_by_field.setdefault(event["field"], []).append(event)
+
+    updated = 0
+    for field, field_events in events_by_field.items():
+        # ownership is part of the filter so events for other users' rows match nothing
+        ownership = Q()
+        for event in field_events:
+            ownership |= Q(
+                pk=event["notification_id"],
+                organization_id=event["org_id"],
+                recipient_id=event["recipient_id"],
+            )
+        updated += Notification.objects.filter(
+            ownership,
+            pk__in=[event["notification_id"] for event in field_events],
+            **{f"{field}__isnull": True},
+        ).update(
+            **{
+                field: Case(
+                    *[
+                        When(
+                            pk=event["notification_id"],
+                            organization_id=event["org_id"],
+                            recipient_id=event["recipient_id"],
+                            then=Value(event["at"]),
+                        )
+                        for event in field_events
+                    ],
+                    default=F(field),
+                    output_field=DateTimeField(),
+                )
+            }
+        )
+    return updated
+
+
 def handle_apns(apns, broadcast_id, data, device, notification_id, user_id):
     credentials_dict = {
         credential.slug: credential.value for credential in apns.credentials.all()
@@ -873,7 +1226,7 @@ def persist_notification(org_id, broadcast_id, recipient_id, **kwargs):
         organization_id=org_id,
         broadcast_id=broadcast_id,
         recipient_id=recipient_id,
-        defaults={**kwargs},
+        defaults={"id": get_notification_id(broadcast_id, recipient_id), **kwargs},
     )
 
 
@@ -916,6 +1269,74 @@ def persist_notification_delivery(
     return notification_channel
 
 
+def persist_notification_deliveries(
+    notification_ids,
+    title=None,
+    content=None,
+    action_link=None,
+    channel=None,
+    **kwargs,
+):
+    if not notification_ids:
+        return
+
+    sent_at = datetime.now(timezone.utc)
+    existing = set(
+        NotificationDelivery.objects.filter(
+            notification_id__in=notification_ids, channel=channel
+        ).values_list("notification_id", flat=True)
+    )
+    if existing:
+        NotificationDelivery.objects.filter(
+            notification_id__in=existing, channel=channel
+        ).update(sent_at=sent_at, **kwargs)
+
+    NotificationDelivery.objects.bulk_create(
+        [
+            NotificationDelivery(
+                notification_id=notification_id,
+                title=title,
+                content=content,
+                action_link=action_link,
+                channel=channel,
+                sent_at=sent_at,
+                **kwargs,
+            )
+            for notification_id in notification_ids
+            if notification_id not in existing
+        ],
+        batch_size=settings.IN_APP_BATCH_SIZE,
+    )
+
+
+def get_broadcast_group(org_id, data, org_wide):
+    # category preferences are per user, so only uncategorized broadcasts to a whole
+    # topic or organization can be published to a shared group
+    if "category" in data or "recipients" in data:
+        return None
+    if "topic" in data and "audience_id" not in data:
+        return get_topic_group(org_id, data["topic"])
+    if org_wide and "topic" not in data:
+        return get_org_group(org_id)
+    return None
+
+
+def build_in_app_event(notification_id, data):
+    return {
+        "object": "event",
+        "type": "notification.created",
+        "data": {
+            "id": str(notification_id) if notification_id else None,
+            "category": data.get("category", ""),
+            "topic": data.get("topic", ""),
+            "title": data["title"],
+            "content": data["content"],
+            "action_link": data.get("action_link"),
+            "additional_info": data.get("additional_info", {}),
+        },
+    }
+
+
 def update_or_create_external_user(broadcast_id, org_id, recipient, data):
     if "external_id" in recipient:
         defaults = {}
@@ -1183,10 +1604,19 @@ def route_basic_notification(broadcast_id, org_id, notification_id, recipient, d
     return
 
 
-def build_filter_kwargs(filters):
+def build_filter_kwargs(filters, metadata_keys=None):
     query_kwargs = {}
     for filter_rec in filters:
+        metadata_key = get_metadata_key(filter_rec.property, metadata_keys)
         filter_rec.property = filter_rec.property.replace(".", "__")
+        if (
+            metadata_key
+            and filter_rec.operator != OperatorChoices.NEQ
+            and build_metadata_filter(
+                query_kwargs, filter_rec, metadata_key, metadata_keys[metadata_key]
+            )
+        ):
+            continue
         if filter_rec.property in basic_fields:
             filter_rec.property = f"{filter_rec.property}_hash"
             filter_rec.value = utils.perform_hash(filter_rec.value)
@@ -1208,10 +1638,19 @@ def build_filter_kwargs(filters):
     return query_kwargs
 
 
-def build_exclude_kwargs(filters):
+def build_exclude_kwargs(filters, metadata_keys=None):
     query_kwargs = {}
     for filter_rec in filters:
+        metadata_key = get_metadata_key(filter_rec.property, metadata_keys)
         filter_rec.property = filter_rec.property.replace(".", "__")
+        if (
+            metadata_key
+            and filter_rec.operator == OperatorChoices.NEQ
+            and build_metadata_filter(
+                query_kwargs, filter_rec, metadata_key, metadata_keys[metadata_key]
+            )
+        ):
+            continue
         match filter_rec.operator:
             case OperatorChoices.NEQ:
                 query_kwargs[filter_rec.property] = filter_rec.value
@@ -1220,3 +1659,69 @@ def build_exclude_kwargs(filters):
             case _:
                 continue
     return query_kwargs
+
+
+def get_metadata_key(property, metadata_keys):
+    # properties are already in lookup form when the exclude kwargs are built
+    path = property.replace("__", ".").split(".", 1)
+    if not metadata_keys or len(path) != 2 or path[0] != "metadata":
+        return None
+    return path[1] if path[1] in metadata_keys else None
+
+
+def build_metadata_filter(query_kwargs, filter_rec, metadata_key, metadata_type):
+    try:
+        value = coerce_metadata_value(filter_rec.value, metadata_type)
+    except ValueError:
+        logging.info(
+            "Filter value for metadata key: %s is not a valid %s, falling back to an untyped lookup",
+            metadata_key,
+            metadata_type,
+        )
+        return False
+
+    match filter_rec.operator:
+        case OperatorChoices.EQ | OperatorChoices.NEQ:
+            # containment is answered by the gin index on metadata
+            for name in reversed(metadata_key.split(".")):
+                value = {name: value}
+            query_kwargs["metadata__contains"] = merge_metadata(
+                query_kwargs.get("metadata__contains", {}), value
+            )
+        case operator if operator in metadata_comparison_lookups:
+            lookup = metadata_comparison_lookups[operator]
+            query_kwargs[f"{filter_rec.property}__{lookup}"] = value
+            # jsonb orders values of different types, this keeps other types out
+            query_kwargs[f"{filter_rec.property}__json_type"] = metadata_json_types[
+                metadata_type
+            ]
+        case _:
+            return False
+    return True
+
+
+def coerce_metadata_value(value, metadata_type):
+    match metadata_type:
+        case MetadataKeyTypeChoices.NUMBER:
+            try:
+                return int(value)
+            except ValueError:
+                number = float(value)
+            if not math.isfinite(number):
+                raise ValueError(value)
+            return number
+        case MetadataKeyTypeChoices.BOOLEAN:
+            if value.lower() not in ("true", "false"):
+                raise ValueError(value)
+            return value.lower() == "true"
+        case _:
+            return value
+
+
+def merge_metadata(target, source):
+    merged = dict(target)
+    for name, value in source.items():
+        if isinstance(value, dict) and isinstance(merged.get(name), dict):
+            value = merge_metadata(merged[name], value)
+        merged[name] = value
+    return merged
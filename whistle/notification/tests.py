@@ -1 +1,121 @@
-# Create your tests here.
+import uuid
+from datetime import datetime, timezone
+
+from django.test import TestCase
+from rest_framework.test import APIClient
+
+from external_user.models import ExternalUser
+from notification.models import (
+    Broadcast,
+    BroadcastStatusChoices,
+    DeliveryStatusChoices,
+    Notification,
+    NotificationDelivery,
+    NotificationStatusChoices,
+)
+from organization.models import Organization
+from preference.models import ChannelChoices
+
+
+class NotificationViewSetQueryCountTest(TestCase):
+    def setUp(self):
+        self.org = Organization.objects.create(
+            clerk_org_id="org_test", name="Test", slug="test"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.org)
+
+        for index in range(5):
+            # blank email avoids a KMS round trip when persisting the recipient
+            recipient = ExternalUser.objects.create(
+                organization=self.org,
+                external_id=f"user_{index}",
+                email="",
+                email_hash=f"email_hash_{index}",
+            )
+            broadcast = Broadcast.objects.create(
+                idempotency_id=uuid.uuid4(),
+                organization=self.org,
+                title="Title",
+                content="Content",
+                status=BroadcastStatusChoices.PROCESSED,
+                sent_at=datetime.now(timezone.utc),
+            )
+            notification = Notification.objects.create(
+                organization=self.org,
+                broadcast=broadcast,
+                recipient=recipient,
+                status=NotificationStatusChoices.PROCESSED,
+            )
+            for channel in [ChannelChoices.IN_APP, ChannelChoices.EMAIL]:
+                NotificationDelivery.objects.create(
+                    notification=notification,
+                    channel=channel,
+                    status=DeliveryStatusChoices.DELIVERED,
+                )
+        self.notification = notification
+
+    def test_list(self):
+        # count, notifications joined with broadcast and recipient, deliveries
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/v1/notifications")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 5)
+        self.assertIn("external_id", response.json()["results"][0]["recipient"])
+
+    def test_list_recipient_as_id(self):
+        # count, notifications joined with broadcast, deliveries
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/v1/notifications?recipient_format=id")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["results"][0]["recipient"],
+            str(
+                Notification.objects.get(
+                    pk=response.json()["results"][0]["id"]
+                ).recipient_id
+            ),
+        )
+
+    def test_list_sparse_fields(self):
+        # count, notifications joined with the recipient's external id only, deliveries
+        with self.assertNumQueries(3) as context:
+            response = self.client.get(
+                "/api/v1/notifications?fields=id,recipient.external_id,deliveries"
+            )
+        self.assertEqual(response.status_code, 200)
+        result = response.json()["results"][0]
+        self.assertEqual(set(result), {"id", "recipient", "deliveries"})
+        self.assertEqual(set(result["recipient"]), {"external_id"})
+        self.assertNotIn('"email"', context.captured_queries[1]["sql"])
+
+    def test_list_expand(self):
+        # count, notifications, delivery ids
+        with self.assertNumQueries(3):
+            response = self.client.get("/api/v1/notifications?expand=broadcast")
+        self.assertEqual(response.status_code, 200)
+        result = response.json()["results"][0]
+        self.assertIn("title", result["broadcast"])
+        self.assertIsInstance(result["recipient"], str)
+        self.assertEqual(len(result["deliveries"]), 2)
+
+    def test_list_invalid_fields(self):
+        response = self.client.get("/api/v1/notifications?fields=id,unknown")
+        self.assertEqual(response.status_code, 400)
+
+    def test_retrieve(self):
+        # notification joined with broadcast and recipient, deliveries
+        with self.assertNumQueries(2):
+            response = self.client.get(f"/api/v1/notifications/{self.notification.id}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["deliveries"]), 2)
+
+    def test_retrieve_recipient_as_id(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                f"/api/v1/notifications/{self.notification.id}?recipient_format=id"
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["recipient"], str(self.notification.recipient_id)
+        )
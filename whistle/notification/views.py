@@ -3,8 +3,12 @@ import uuid
 from datetime import datetime, timezone, timedelta
 
 from celery.schedules import schedule
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
 from django.db import transaction
-from django.http import JsonResponse
+from django.db.models import F
+from django.http import JsonResponse, Http404
+from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter
 from redbeat import RedBeatSchedulerEntry, RedBeatScheduler
 from rest_framework import mixins, status
 from rest_framework.decorators import action
@@ -12,9 +16,10 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet, ReadOnlyModelViewSet
 
-from external_user.models import ExternalUser
+from notification.engagement import buffer_engagement_events
 from notification.models import (
     Notification,
+    NotificationDelivery,
     Broadcast,
     BroadcastStatusChoices,
     DeliveryStatusChoices,
@@ -24,14 +29,19 @@ from notification.serializers import (
     BroadcastSerializer,
     NotificationStatusSerializer,
     InboxSerializer,
+    InboxBulkUpdateSerializer,
+    ExportFilterSerializer,
 )
 from preference.models import ChannelChoices
 from whistle.auth import (
     ClientAuth,
     ServerAuth,
     IsValidExternalId,
+    get_external_user,
 )
 from whistle.celery import app
+from whistle.exports import export_response, export_response_schema
+from whistle.fieldsets import SparseFieldsetMixin
 from whistle.pagination import StandardLimitOffsetPagination
 from .tasks import send_broadcast
 
@@ -45,28 +55,15 @@ class InboxViewSet(ReadOnlyModelViewSet):
 
     def get_serializer_class(self):
         extra_actions = [action.__name__ for action in self.get_extra_actions()]
+        if self.action in extra_actions and self.action.startswith("bulk_"):
+            return InboxBulkUpdateSerializer
         if self.action in extra_actions:
             return NotificationStatusSerializer
         return super().get_serializer_class()
 
     def get_queryset(self):
-        external_id = self.request.headers.get("X-External-Id")
         org = self.request.user
-        try:
-            user = ExternalUser.objects.get(
-                external_id=external_id,
-                organization=self.request.user,
-            )
-        except ExternalUser.DoesNotExist:
-            logging.error(
-                "Invalid external id: %s provided for org: %s while querying preferences",
-                external_id,
-                self.request.user.id,
-            )
-            raise ValidationError(
-                "Invalid External Id. Please provide a valid External Id in the request header.",
-                "invalid_external_id",
-            )
+        user = get_external_user(self.request)
         return self.queryset.prefetch_related("deliveries").filter(
             recipient=user,
             organization=org,
@@ -76,48 +73,129 @@ class InboxViewSet(ReadOnlyModelViewSet):
 
     @action(methods=["POST"], detail=True)
     def read(self, request, **kwargs):
-        notification = self.get_object()
-        notification.read_at = datetime.now(timezone.utc)
-        notification.save()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.update_notification(read_at=datetime.now(timezone.utc))
 
     @action(methods=["POST"], detail=True)
     def unread(self, request, **kwargs):
-        notification = self.get_object()
-        notification.read_at = None
-        notification.save()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.update_notification(read_at=None)
 
     @action(methods=["POST"], detail=True)
     def seen(self, request, **kwargs):
-        notification = self.get_object()
-        notification.seen_at = datetime.now(timezone.utc)
-        notification.save()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        if settings.BUFFER_ENGAGEMENT_EVENTS:
+            return self.buffer_notification_engagement("seen_at")
+        return self.update_notification(seen_at=datetime.now(timezone.utc))
 
     @action(methods=["POST"], detail=True)
     def archive(self, request, **kwargs):
-        notification = self.get_object()
-        notification.archived_at = datetime.now(timezone.utc)
-        notification.save()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.update_notification(archived_at=datetime.now(timezone.utc))
 
     @action(methods=["POST"], detail=True)
     def unarchive(self, request, **kwargs):
-        notification = self.get_object()
-        notification.archived_at = None
-        notification.save()
-        return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.update_notification(archived_at=None)
 
     @action(methods=["POST"], detail=True)
     def clicked(self, request, **kwargs):
-        notification = self.get_object()
-        notification.clicked_at = datetime.now(timezone.utc)
-        notification.save()
+        if settings.BUFFER_ENGAGEMENT_EVENTS:
+            return self.buffer_notification_engagement("clicked_at")
+        return self.update_notification(clicked_at=datetime.now(timezone.utc))
+
+    @action(methods=["POST"], detail=False, url_path="bulk/read")
+    def bulk_read(self, request, **kwargs):
+        return self.bulk_update_notifications("read_at", datetime.now(timezone.utc))
+
+    @action(methods=["POST"], detail=False, url_path="bulk/unread")
+    def bulk_unread(self, request, **kwargs):
+        return self.bulk_update_notifications("read_at", None)
+
+    @action(methods=["POST"], detail=False, url_path="bulk/seen")
+    def bulk_seen(self, request, **kwargs):
+        if settings.BUFFER_ENGAGEMENT_EVENTS and "ids" in request.data:
+            return self.bulk_buffer_notification_engagement("seen_at")
+        return self.bulk_update_notifications("seen_at", datetime.now(timezone.utc))
+
+    @action(methods=["POST"], detail=False, url_path="bulk/archive")
+    def bulk_archive(self, request, **kwargs):
+        return self.bulk_update_notifications("archived_at", datetime.now(timezone.utc))
+
+    @action(methods=["POST"], detail=False, url_path="bulk/unarchive")
+    def bulk_unarchive(self, request, **kwargs):
+        return self.bulk_update_notifications("archived_at", None)
+
+    @action(methods=["POST"], detail=False, url_path="bulk/clicked")
+    def bulk_clicked(self, request, **kwargs):
+        if settings.BUFFER_ENGAGEMENT_EVENTS and "ids" in request.data:
+            return self.bulk_buffer_notification_engagement("clicked_at")
+        return self.bulk_update_notifications("clicked_at", datetime.now(timezone.utc))
+
+    def update_notification(self, **values):
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            updated = queryset.filter(pk=self.kwargs["pk"]).update(**values)
+        except (TypeError, ValueError, DjangoValidationError):
+            updated = 0
+        if not updated:
+            raise Http404
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def buffer_notification_engagement(self, field):
+        try:
+            notification_id = uuid.UUID(str(self.kwargs["pk"]))
+        except ValueError:
+            raise Http404
+        user = get_external_user(self.request)
+        buffer_engagement_events(
+            self.request.user.id, user.id, [notification_id], field
+        )
+        return Response(status=status.HTTP_202_ACCEPTED)
+
+    def bulk_buffer_notification_engagement(self, field):
+        serializer = self.get_serializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        user = get_external_user(self.request)
+        count = buffer_engagement_events(
+            self.request.user.id, user.id, serializer.validated_data["ids"], field
+        )
+        return Response({"count": count}, status=status.HTTP_202_ACCEPTED)
+
+    def bulk_update_notifications(self, field, value):
+        serializer = self.get_serializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        if "ids" in serializer.validated_data:
+            queryset = queryset.filter(pk__in=serializer.validated_data["ids"])
+        elif "before" in serializer.validated_data:
+            queryset = queryset.filter(
+                broadcast__sent_at__lte=serializer.validated_data["before"]
+            )
+
+        # only touch rows whose state actually changes so the count is meaningful
+        # and existing timestamps are preserved
+        count = queryset.filter(**{f"{field}__isnull": value is not None}).update(
+            **{field: value}
+        )
+        logging.info(
+            "Bulk updated %s on %s notifications for org: %s",
+            field,
+            count,
+            self.request.user.id,
+        )
+        return Response({"count": count})
+
+
+recipient_format_parameter = OpenApiParameter(
+    name="recipient_format",
+    description="Set to 'id' to return the recipient as an ID instead of a nested user.",
+    required=False,
+    enum=["id"],
+)
+
 
-class NotificationViewSet(ReadOnlyModelViewSet):
+@extend_schema_view(
+    list=extend_schema(parameters=[recipient_format_parameter]),
+    retrieve=extend_schema(parameters=[recipient_format_parameter]),
+)
+class NotificationViewSet(SparseFieldsetMixin, ReadOnlyModelViewSet):
     queryset = Notification.objects.all()
     serializer_class = NotificationSerializer
     authentication_classes = [ServerAuth]
@@ -131,10 +209,80 @@ class NotificationViewSet(ReadOnlyModelViewSet):
 
     def get_queryset(self):
         org = self.request.user
-        return self.queryset.filter(organization=org)
+        return (
+            self.queryset.filter(organization=org)
+            .select_related("broadcast", "recipient")
+            .prefetch_related("deliveries")
+        )
+
+    @extend_schema(
+        parameters=[ExportFilterSerializer], responses=export_response_schema
+    )
+    @action(methods=["GET"], detail=False)
+    def export(self, request, **kwargs):
+        notifications = self.get_export_queryset(
+            Notification.objects.filter(organization=request.user), "broadcast_id"
+        )
+        rows = notifications.values(
+            "id",
+            "status",
+            "broadcast_id",
+            "recipient_id",
+            "seen_at",
+            "read_at",
+            "clicked_at",
+            "archived_at",
+            external_id=F("recipient__external_id"),
+        ).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+        return export_response(request, rows, "notifications")
+
+    @extend_schema(
+        parameters=[ExportFilterSerializer], responses=export_response_schema
+    )
+    @action(methods=["GET"], detail=False, url_path="deliveries/export")
+    def deliveries_export(self, request, **kwargs):
+        deliveries = self.get_export_queryset(
+            NotificationDelivery.objects.filter(
+                notification__organization=request.user
+            ),
+            "notification__broadcast_id",
+        )
+        rows = deliveries.values(
+            "id",
+            "notification_id",
+            "channel",
+            "status",
+            "title",
+            "content",
+            "action_link",
+            "error_reason",
+            "metadata",
+            "sent_at",
+            broadcast_id=F("notification__broadcast_id"),
+            recipient_id=F("notification__recipient_id"),
+        ).iterator(chunk_size=settings.EXPORT_CHUNK_SIZE)
+        return export_response(request, rows, "deliveries")
+
+    def get_export_queryset(self, queryset, broadcast_field):
+        serializer = ExportFilterSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        if "broadcast" in serializer.validated_data:
+            queryset = queryset.filter(
+                **{broadcast_field: serializer.validated_data["broadcast"]}
+            )
+        return queryset.order_by("pk")
+
+    def get_fieldset(self):
+        fields, expand = super().get_fieldset()
+        if self.request.query_params.get("recipient_format") == "id":
+            if expand is None:
+                expand = {"broadcast", "deliveries"}
+            expand.discard("recipient")
+        return fields, expand
 
 
 class BroadcastViewSet(
+    SparseFieldsetMixin,
     mixins.ListModelMixin,
     mixins.RetrieveModelMixin,
     GenericViewSet,
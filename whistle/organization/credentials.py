@@ -0,0 +1,219 @@
+import logging
+import threading
+import time
+
+import cachetools
+import redis
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from organization.models import Organization, OrganizationCredentials
+
+credentials_cache = cachetools.TTLCache(
+    maxsize=settings.API_CREDENTIALS_CACHE_SIZE,
+    ttl=settings.API_CREDENTIALS_CACHE_TTL,
+)
+credentials_cache_lock = threading.Lock()
+
+organization_fields = ["id", "clerk_org_id", "name", "slug"]
+
+
+class CachedCredentials:
+    __slots__ = (
+        "organization",
+        "api_key_hash",
+        "api_secret_hash",
+        "api_secret_salt",
+        "api_secret_cipher_text",
+        "generation",
+        "checked_at",
+        "_api_secret",
+    )
+
+    def __init__(
+        self,
+        organization,
+        api_key_hash,
+        api_secret_hash,
+        api_secret_salt,
+        api_secret_cipher_text,
+        generation,
+    ):
+        self.organization = organization
+        self.api_key_hash = api_key_hash
+        self.api_secret_hash = api_secret_hash
+        self.api_secret_salt = api_secret_salt
+        self.api_secret_cipher_text = api_secret_cipher_text
+        self.generation = generation
+        self.checked_at = 0
+        self._api_secret = None
+
+    @property
+    def api_secret(self):
+        if self._api_secret is None:
+            field = OrganizationCredentials._meta.get_field("api_secret")
+            self._api_secret = field.decrypt(self.api_secret_cipher_text)
+        return self._api_secret
+
+    @classmethod
+    def from_instance(cls, instance, generation):
+        return cls(
+            organization=instance.organization,
+            api_key_hash=instance.api_key_hash,
+            api_secret_hash=instance.api_secret_hash,
+            api_secret_salt=instance.api_secret_salt,
+            api_secret_cipher_text=instance.__dict__["api_secret"].cipher_text,
+            generation=generation,
+        )
+
+    @classmethod
+    def from_cache(cls, values):
+        return cls(
+            organization=Organization.from_db(
+                DEFAULT_DB_ALIAS,
+                organization_fields,
+                [values["organization"][name] for name in organization_fields],
+            ),
+            api_key_hash=values["api_key_hash"],
+            api_secret_hash=values["api_secret_hash"],
+            api_secret_salt=values["api_secret_salt"],
+            api_secret_cipher_text=values["api_secret_cipher_text"],
+            generation=values.get("generation"),
+        )
+
+    def to_cache(self):
+        # only the encrypted secret leaves the process
+        return {
+            "organization": {
+                name: getattr(self.organization, name) for name in organization_fields
+            },
+            "api_key_hash": self.api_key_hash,
+            "api_secret_hash": self.api_secret_hash,
+            "api_secret_salt": self.api_secret_salt,
+            "api_secret_cipher_text": self.api_secret_cipher_text,
+            "generation": self.generation,
+        }
+
+
+def get_api_key_cache_key(api_key_hash):
+    return f"credentials:api_key:{api_key_hash}"
+
+
+def get_organization_cache_key(organization_id):
+    return f"credentials:organization:{organization_id}"
+
+
+def get_generation_cache_key(organization_id):
+    return f"credentials:generation:{organization_id}"
+
+
+def get_generation(organization_id):
+    return cache.get(get_generation_cache_key(organization_id), 0)
+
+
+def get_cached_credentials(api_key_hash=None, organization_id=None):
+    if api_key_hash is not None:
+        cache_key = get_api_key_cache_key(api_key_hash)
+        lookup = {"api_key_hash": api_key_hash}
+    else:
+        cache_key = get_organization_cache_key(organization_id)
+        lookup = {"organization_id": organization_id}
+
+    # the generation in redis is checked at most once per interval, so a rotation
+    # on another process is seen within API_CREDENTIALS_GENERATION_CHECK_INTERVAL
+    with credentials_cache_lock:
+        credentials = credentials_cache.get(cache_key)
+    if credentials is not None and time.monotonic() < credentials.checked_at + (
+        settings.API_CREDENTIALS_GENERATION_CHECK_INTERVAL
+    ):
+        return credentials
+
+    try:
+        if credentials is not None and credentials.generation != get_generation(
+            credentials.organization.id
+        ):
+            with credentials_cache_lock:
+                credentials_cache.pop(cache_key, None)
+            credentials = None
+
+        if credentials is None:
+            values = cache.get(cache_key)
+            if values is not None:
+                credentials = CachedCredentials.from_cache(values)
+                if credentials.generation != get_generation(
+                    credentials.organization.id
+                ):
+                    credentials = None
+
+        if credentials is None:
+            credentials = load_credentials(lookup, organization_id)
+            if credentials is None:
+                return None
+            values = credentials.to_cache()
+            cache.set_many(
+                {
+                    get_api_key_cache_key(credentials.api_key_hash): values,
+                    get_organization_cache_key(credentials.organization.id): values,
+                },
+                settings.API_CREDENTIALS_REDIS_CACHE_TTL,
+            )
+    except redis.RedisError as error:
+        logging.warning("Credentials cache lookup failed with error: %s", error)
+        # without the generation a rotation can't be detected, so nothing is cached
+        try:
+            instance = OrganizationCredentials.objects.select_related(
+                "organization"
+            ).get(**lookup)
+        except OrganizationCredentials.DoesNotExist:
+            return None
+        return CachedCredentials.from_instance(instance, None)
+
+    credentials.checked_at = time.monotonic()
+    with credentials_cache_lock:
+        credentials_cache[get_api_key_cache_key(credentials.api_key_hash)] = credentials
+        credentials_cache[get_organization_cache_key(credentials.organization.id)] = (
+            credentials
+        )
+    return credentials
+
+
+def load_credentials(lookup, organization_id=None):
+    if organization_id is None:
+        organization_id = (
+            OrganizationCredentials.objects.filter(**lookup)
+            .values_list("organization_id", flat=True)
+            .first()
+        )
+        if organization_id is None:
+            return None
+    # read before the credentials so a rotation committed after the read is not cached as current
+    generation = get_generation(organization_id)
+    try:
+        instance = OrganizationCredentials.objects.select_related("organization").get(
+            **lookup
+        )
+    except OrganizationCredentials.DoesNotExist:
+        return None
+    return CachedCredentials.from_instance(instance, generation)
+
+
+def invalidate_cached_credentials(api_key_hash, organization_id):
+    transaction.on_commit(
+        lambda: clear_cached_credentials(api_key_hash, organization_id)
+    )
+
+
+def clear_cached_credentials(api_key_hash, organization_id):
+    generation_key = get_generation_cache_key(organization_id)
+    cache.add(generation_key, 0, None)
+    cache.incr(generation_key)
+
+    cache_keys = [
+        get_api_key_cache_key(api_key_hash),
+        get_organization_cache_key(organization_id),
+    ]
+    cache.delete_many(cache_keys)
+    with credentials_cache_lock:
+        for cache_key in cache_keys:
+            credentials_cache.pop(cache_key, None)
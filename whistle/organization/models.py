@@ -27,10 +27,12 @@ class OrganizationCredentials(models.Model):
 
     api_secret_salt = models.CharField(unique=True)
 
+    objects = fields.EncryptedQuerySet.as_manager()
+
     def save(self, *args, **kwargs):
-        if self.api_key:
+        if not fields.is_encrypted(self, "api_key") and self.api_key:
             self.api_key_hash = utils.perform_hash(self.api_key)
-        if self.api_secret:
+        if not fields.is_encrypted(self, "api_secret") and self.api_secret:
             self.api_secret_hash = utils.perform_hash(
                 self.api_secret, self.api_secret_salt
             )
@@ -3,6 +3,7 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
+from organization.credentials import invalidate_cached_credentials
 from organization.models import OrganizationCredentials
 from organization.serializers import (
     OrganizationSerializer,
@@ -35,6 +36,7 @@ class OrganizationCredentialsViewSet(GenericViewSet):
     @action(methods=["POST"], detail=False)
     def regenerate(self, request, **kwargs):
         instance = OrganizationCredentials.objects.get(organization=self.request.user)
+        api_key_hash = instance.api_key_hash
 
         (
             api_key,
@@ -46,6 +48,7 @@ class OrganizationCredentialsViewSet(GenericViewSet):
         instance.api_secret = api_secret
         instance.api_secret_salt = api_secret_salt
         instance.save()
+        invalidate_cached_credentials(api_key_hash, instance.organization_id)
 
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
@@ -3,12 +3,12 @@ import logging
 from django.db import transaction
 from rest_framework import serializers
 
-from external_user.models import ExternalUser
 from preference.models import (
     ExternalUserPreferenceChannel,
     ExternalUserPreference,
     ChannelChoices,
 )
+from whistle.auth import get_external_user
 
 
 class ExternalUserPreferenceChannelSerializer(serializers.ModelSerializer):
@@ -39,56 +39,41 @@ class ExternalUserPreferenceSerializer(serializers.ModelSerializer):
     @transaction.atomic
     def create(self, validated_data):
         org = self.context["request"].user
-        external_id = self.context.get("external_id")
-        try:
-            channels_data = validated_data.pop("channels", [])
-            external_user = ExternalUser.objects.get(
-                organization=org, external_id=external_id
-            )
-
-            user_preference = ExternalUserPreference.objects.create(
-                organization=org, user=external_user, slug=validated_data["slug"]
-            )
+        channels_data = validated_data.pop("channels", [])
+        external_user = get_external_user(self.context["request"])
 
-            default_channels = [
-                {"slug": "web", "enabled": True},
-                {"slug": "email", "enabled": True},
-                {"slug": "sms", "enabled": True},
-            ]
+        user_preference = ExternalUserPreference.objects.create(
+            organization=org, user=external_user, slug=validated_data["slug"]
+        )
 
-            for channel in channels_data:
-                for default_channel in default_channels:
-                    if channel["slug"] == default_channel["slug"]:
-                        default_channel.update(channel)
+        default_channels = [
+            {"slug": "web", "enabled": True},
+            {"slug": "email", "enabled": True},
+            {"slug": "sms", "enabled": True},
+        ]
 
-            for channel in default_channels:
-                ExternalUserPreferenceChannel.objects.create(
-                    user_preference=user_preference, **channel
-                )
+        for channel in channels_data:
+            for default_channel in default_channels:
+                if channel["slug"] == default_channel["slug"]:
+                    default_channel.update(channel)
 
-            logging.info(
-                "Preference with id: %s created for user: %s in org: %s",
-                user_preference.id,
-                external_user.id,
-                org.id,
+        for channel in default_channels:
+            ExternalUserPreferenceChannel.objects.create(
+                user_preference=user_preference, **channel
             )
 
-            return user_preference
-        except ExternalUser.DoesNotExist:
-            logging.error(
-                "Invalid external id: %s provided for org: %s while creating preference",
-                external_id,
-                org.id,
-            )
-            raise serializers.ValidationError(
-                "Invalid External Id. Please provide a valid External Id in the request header.",
-                "invalid_external_id",
-            )
+        logging.info(
+            "Preference with id: %s created for user: %s in org: %s",
+            user_preference.id,
+            external_user.id,
+            org.id,
+        )
+
+        return user_preference
 
     @transaction.atomic
     def update(self, instance, validated_data, **kwargs):
         org = self.context["request"].user
-        external_id = self.context.get("external_id")
         channels_data = validated_data.pop("channels", [])
         instance.channel = validated_data.get("slug", instance.channel)
         instance.save()
@@ -44,6 +44,8 @@ class ProviderCredential(models.Model):
     slug = models.SlugField()
     value = fields.EncryptedField(EncryptedFieldTypeChoices.API_CREDENTIALS)
 
+    objects = fields.EncryptedQuerySet.as_manager()
+
     class Meta:
         unique_together = [
             ["provider", "slug"],
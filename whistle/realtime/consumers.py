@@ -1,74 +1,293 @@
+import asyncio
 import json
 import logging
+from urllib.parse import parse_qs
 
+import redis
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.db import DatabaseError
+from rest_framework.exceptions import ErrorDetail
+
+from notification.engagement import (
+    abuffer_engagement_events,
+    buffered_engagement_fields,
+    update_engagement,
+)
+from realtime.events import (
+    EVENT_ID_PATTERN,
+    build_broadcast_event,
+    parse_event_id,
+    read_events_since,
+    set_event_cursor,
+    get_event_cursor,
+)
+from realtime.groups import (
+    get_user_group,
+    get_org_group,
+    get_subscribed_topic_groups,
+)
+from realtime.presence import mark_online, mark_offline
+from realtime.serializers import (
+    RealtimeMessageSerializer,
+    RealtimeMessageActionChoices,
+)
 
 
 class NotificationConsumer(AsyncWebsocketConsumer):
+    heartbeat_task = None
+    last_event_id = None
+    topic_groups = frozenset()
+    coalesce = False
+    flush_task = None
+
     async def connect(self):
-        if (
-            "org" in self.scope
-            and "external_user" in self.scope
-            and "api_key" in self.scope
-        ):
-            org = self.scope["org"]
-            external_user = self.scope["external_user"]
+        if "principal" in self.scope:
+            principal = self.scope["principal"]
             await self.channel_layer.group_add(
-                f"user_{external_user.id}", self.channel_name
+                get_user_group(principal.user_id), self.channel_name
             )
-            await self.accept(self.scope["api_key"])
+            await self.channel_layer.group_add(
+                get_org_group(principal.org_id), self.channel_name
+            )
+            await self.sync_topic_groups()
+            await self.accept(self.scope.get("api_key"))
+            await mark_online(principal.user_id, self.channel_name)
+            self.heartbeat_task = asyncio.create_task(self.heartbeat())
             logging.info(
                 "Connection accepted on channel: %s for user: %s and org: %s",
                 self.channel_name,
-                external_user.id,
-                org.id,
+                principal.user_id,
+                principal.org_id,
             )
+            params = parse_qs(self.scope["query_string"].decode())
+            # clients opting in receive bursts of events as one array frame
+            self.coalesce = params.get("coalesce", ["0"])[0] in ("1", "true")
+            self.pending_events = []
+            if "last_event_id" in params:
+                await self.replay(params["last_event_id"][0])
+            else:
+                # fall back to the last event the client acknowledged over the socket
+                try:
+                    last_event_id = await get_event_cursor(principal.user_id)
+                except redis.RedisError:
+                    last_event_id = None
+                if last_event_id:
+                    await self.replay(last_event_id)
         elif "error_code" in self.scope and "error_reason" in self.scope:
             await self.close(self.scope["error_code"], self.scope["error_reason"])
         else:
             await self.close()
 
     async def disconnect(self, close_code):
-        if (
-            "org" in self.scope
-            and "external_user" in self.scope
-            and "api_key" in self.scope
-        ):
-            org = self.scope["org"]
-            external_user = self.scope["external_user"]
-            await self.channel_layer.group_discard(
-                f"user_{external_user.id}", self.channel_name
-            )
+        if "principal" in self.scope:
+            principal = self.scope["principal"]
+            if self.heartbeat_task:
+                self.heartbeat_task.cancel()
+            if self.flush_task:
+                self.flush_task.cancel()
+            await mark_offline(principal.user_id, self.channel_name)
+            for group in (
+                get_user_group(principal.user_id),
+                get_org_group(principal.org_id),
+                *self.topic_groups,
+            ):
+                await self.channel_layer.group_discard(group, self.channel_name)
             logging.debug(
                 "Channel: %s with user: %s and org: %s disconnected with close code: %s",
                 self.channel_name,
-                external_user.id,
-                org.id,
+                principal.user_id,
+                principal.org_id,
                 close_code,
             )
         else:
             pass
 
-    async def receive(self, text_data):
-        org = self.scope["org"]
-        external_user = self.scope["external_user"]
-        logging.info(
-            f"Channel: %s with user: %s and org: %s sent message: ",
+    async def receive(self, text_data=None, bytes_data=None):
+        principal = self.scope["principal"]
+        try:
+            payload = json.loads(text_data)
+        except (TypeError, ValueError):
+            await self.send_error(
+                "invalid_message", "Messages must be JSON objects with an action."
+            )
+            return
+
+        serializer = RealtimeMessageSerializer(data=payload)
+        if not serializer.is_valid():
+            detail = first_error(serializer.errors)
+            await self.send_error(detail.code, str(detail))
+            return
+
+        action = serializer.validated_data["action"]
+        try:
+            if action == RealtimeMessageActionChoices.ACK:
+                count = 1
+                await set_event_cursor(
+                    principal.user_id, serializer.validated_data["event_id"]
+                )
+            elif (
+                settings.BUFFER_ENGAGEMENT_EVENTS
+                and f"{action}_at" in buffered_engagement_fields
+            ):
+                count = await abuffer_engagement_events(
+                    principal.org_id,
+                    principal.user_id,
+                    serializer.validated_data["ids"],
+                    f"{action}_at",
+                )
+            else:
+                count = await database_sync_to_async(update_engagement)(
+                    principal.org_id,
+                    principal.user_id,
+                    serializer.validated_data["ids"],
+                    f"{action}_at",
+                )
+        except (redis.RedisError, DatabaseError) as error:
+            logging.error(
+                "Handling %s message failed for channel: %s with error: %s",
+                action,
+                self.channel_name,
+                error,
+            )
+            await self.send_error(
+                "temporarily_unavailable", "Please retry the request shortly."
+            )
+            return
+
+        await self.send(
+            text_data=json.dumps(
+                {"object": "receipt", "action": action, "count": count}
+            )
+        )
+        logging.debug(
+            "Channel: %s with user: %s and org: %s sent %s for %s notifications",
             self.channel_name,
-            external_user.id,
-            org.id,
-            text_data,
+            principal.user_id,
+            principal.org_id,
+            action,
+            count,
+        )
+
+    async def send_event(self, event):
+        if not self.coalesce:
+            await self.send(text_data=json.dumps(event))
+            return
+
+        self.pending_events.append(event)
+        if len(self.pending_events) >= settings.REALTIME_COALESCE_MAX_EVENTS:
+            await self.flush_events()
+        elif not self.flush_task:
+            self.flush_task = asyncio.create_task(self.delayed_flush())
+
+    async def delayed_flush(self):
+        await asyncio.sleep(settings.REALTIME_COALESCE_INTERVAL)
+        self.flush_task = None
+        await self.flush_events()
+
+    async def flush_events(self):
+        if self.flush_task:
+            self.flush_task.cancel()
+            self.flush_task = None
+        events, self.pending_events = self.pending_events, []
+        if events:
+            await self.send(text_data=json.dumps(events))
+
+    async def send_error(self, code, reason):
+        await self.send(
+            text_data=json.dumps({"object": "error", "code": code, "reason": reason})
+        )
+
+    def is_replayed(self, event):
+        # already delivered by the replay on connect
+        return (
+            self.last_event_id is not None
+            and "event_id" in event
+            and parse_event_id(event["event_id"]) <= parse_event_id(self.last_event_id)
         )
 
     async def notification_created(self, event):
-        org = self.scope["org"]
-        external_user = self.scope["external_user"]
-        json_data = json.dumps(event)
-        await self.send(text_data=json_data)
-        logging.info(
-            "Web push notification sent for channel: %s with user: %s and org: %s with event: %s",
+        principal = self.scope["principal"]
+        if self.is_replayed(event):
+            return
+        await self.send_event(event)
+        logging.debug(
+            "Web push notification sent for channel: %s with user: %s and org: %s",
+            self.channel_name,
+            principal.user_id,
+            principal.org_id,
+        )
+
+    async def broadcast_created(self, event):
+        principal = self.scope["principal"]
+        if self.is_replayed(event):
+            return
+        await self.send_event(build_broadcast_event(event, principal.user_id))
+        logging.debug(
+            "Broadcast: %s sent for channel: %s",
+            event["broadcast_id"],
             self.channel_name,
-            external_user.id,
-            org.id,
-            event,
         )
+
+    async def subscriptions_changed(self, event):
+        await self.sync_topic_groups()
+
+    async def sync_topic_groups(self):
+        principal = self.scope["principal"]
+        topic_groups = await database_sync_to_async(get_subscribed_topic_groups)(
+            principal.org_id, principal.user_id
+        )
+        for group in topic_groups - self.topic_groups:
+            await self.channel_layer.group_add(group, self.channel_name)
+        for group in self.topic_groups - topic_groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
+        self.topic_groups = frozenset(topic_groups)
+
+    async def replay(self, last_event_id):
+        if not EVENT_ID_PATTERN.match(last_event_id):
+            await self.send_error(
+                "invalid_last_event_id",
+                "Invalid last event ID. Please provide the event_id of the last received event.",
+            )
+            return
+
+        principal = self.scope["principal"]
+        try:
+            events, truncated = await read_events_since(
+                principal.user_id,
+                last_event_id,
+                [get_org_group(principal.org_id), *self.topic_groups],
+            )
+        except redis.RedisError as error:
+            logging.warning(
+                "Replay failed for channel: %s with error: %s", self.channel_name, error
+            )
+            events, truncated = [], True
+
+        if truncated:
+            # older events are gone, the client should refetch its inbox
+            await self.send_event({"object": "event", "type": "events.truncated"})
+        for event in events:
+            await self.send_event(event)
+        if events:
+            self.last_event_id = events[-1]["event_id"]
+        logging.debug(
+            "Replayed %s events after: %s for channel: %s",
+            len(events),
+            last_event_id,
+            self.channel_name,
+        )
+
+    async def heartbeat(self):
+        principal = self.scope["principal"]
+        while True:
+            await asyncio.sleep(settings.REALTIME_PRESENCE_HEARTBEAT_INTERVAL)
+            await mark_online(principal.user_id, self.channel_name)
+
+
+def first_error(errors):
+    # nested serializer and list field errors are dicts and lists of ErrorDetail
+    while not isinstance(errors, ErrorDetail):
+        errors = next(iter(errors.values() if isinstance(errors, dict) else errors))
+    return errors
@@ -0,0 +1,162 @@
+import json
+import logging
+import re
+import time
+import uuid
+
+import redis
+from django.conf import settings
+
+from notification.models import get_notification_id
+from whistle.cache import redis_client, async_redis_client
+
+EVENT_ID_PATTERN = re.compile(r"^\d+-\d+$")
+
+BROADCAST_PUBLISHED = b"published"
+
+
+def get_event_log_key(user_id):
+    return f"events:user:{user_id}"
+
+
+def get_group_event_log_key(group):
+    return f"events:group:{group}"
+
+
+def get_broadcast_marker_key(broadcast_id):
+    return f"events:broadcast:{broadcast_id}"
+
+
+def get_event_cursor_key(user_id):
+    return f"events:cursor:{user_id}"
+
+
+def parse_event_id(event_id):
+    timestamp, sequence = event_id.split("-")
+    return int(timestamp), int(sequence)
+
+
+def build_broadcast_event(message, user_id):
+    # published once per org or topic group, the notification id is derived per user
+    event = message["event"]
+    notification_id = get_notification_id(uuid.UUID(message["broadcast_id"]), user_id)
+    event = {**event, "data": {**event["data"], "id": str(notification_id)}}
+    if "event_id" in message:
+        event["event_id"] = message["event_id"]
+    return event
+
+
+def get_event_marker_key(notification_id):
+    return f"events:notification:{notification_id}"
+
+
+def append_events(events):
+    if not events:
+        return events
+
+    try:
+        # a retried task reuses the entry appended for the notification on an earlier attempt
+        marker_keys = [get_event_marker_key(event["data"]["id"]) for _, event in events]
+        appended = []
+        pipe = redis_client.pipeline(transaction=False)
+        for (user_id, event), marker_key, event_id in zip(
+            events, marker_keys, redis_client.mget(marker_keys)
+        ):
+            if event_id:
+                event["event_id"] = event_id.decode()
+                continue
+            key = get_event_log_key(user_id)
+            pipe.xadd(
+                key,
+                {"event": json.dumps(event)},
+                maxlen=settings.REALTIME_EVENT_LOG_MAXLEN,
+                approximate=True,
+            )
+            pipe.expire(key, settings.REALTIME_EVENT_LOG_TTL)
+            appended.append((event, marker_key))
+        results = pipe.execute()
+
+        pipe = redis_client.pipeline(transaction=False)
+        for (event, marker_key), event_id in zip(appended, results[::2]):
+            event["event_id"] = event_id.decode()
+            pipe.set(marker_key, event_id, ex=settings.REALTIME_EVENT_LOG_TTL)
+        pipe.execute()
+    except redis.RedisError as error:
+        # events are still published, they just can't be replayed
+        logging.warning("Appending %s events failed with error: %s", len(events), error)
+        return events
+
+    return events
+
+
+def append_group_event(group, message):
+    # members replay it from the group's log, the notification id is derived on read
+    key = get_group_event_log_key(group)
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.xadd(
+            key,
+            {"event": json.dumps(message)},
+            maxlen=settings.REALTIME_EVENT_LOG_MAXLEN,
+            approximate=True,
+        )
+        pipe.expire(key, settings.REALTIME_EVENT_LOG_TTL)
+        event_id, _ = pipe.execute()
+    except redis.RedisError as error:
+        logging.warning(
+            "Appending event for group: %s failed with error: %s", group, error
+        )
+        return message
+
+    message["event_id"] = event_id.decode()
+    return message
+
+
+async def read_events_since(user_id, last_event_id, groups=()):
+    keys = [get_event_log_key(user_id), *map(get_group_event_log_key, groups)]
+    pipe = async_redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipe.xrange(key, min="-", max="+", count=1)
+        pipe.xlen(key)
+        pipe.xrange(
+            key,
+            min=f"({last_event_id}",
+            max="+",
+            count=settings.REALTIME_EVENT_LOG_MAXLEN,
+        )
+    results = await pipe.execute()
+
+    cursor = parse_event_id(last_event_id)
+    # a log expires a ttl after its last append, so one newer than the cursor is intact
+    truncated = cursor[0] < (time.time() - settings.REALTIME_EVENT_LOG_TTL) * 1000
+    events = []
+    for index, key in enumerate(keys):
+        first_entries, length, entries = results[index * 3 : index * 3 + 3]
+        for event_id, fields in entries:
+            event = json.loads(fields[b"event"])
+            if index:
+                event = build_broadcast_event(event, user_id)
+            event["event_id"] = event_id.decode()
+            events.append(event)
+        # logs are only trimmed once they reach maxlen, a full page may hide more
+        truncated = (
+            truncated
+            or len(entries) >= settings.REALTIME_EVENT_LOG_MAXLEN
+            or (
+                length >= settings.REALTIME_EVENT_LOG_MAXLEN
+                and parse_event_id(first_entries[0][0].decode()) > cursor
+            )
+        )
+    events.sort(key=lambda event: parse_event_id(event["event_id"]))
+    return events, truncated
+
+
+async def set_event_cursor(user_id, event_id):
+    await async_redis_client.set(
+        get_event_cursor_key(user_id), event_id, ex=settings.REALTIME_EVENT_LOG_TTL
+    )
+
+
+async def get_event_cursor(user_id):
+    event_id = await async_redis_client.get(get_event_cursor_key(user_id))
+    return event_id.decode() if event_id else None
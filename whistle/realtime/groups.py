@@ -0,0 +1,42 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from subscription.models import ExternalUserSubscription
+
+
+def get_user_group(user_id):
+    return f"user_{user_id}"
+
+
+def get_org_group(org_id):
+    return f"org_{org_id}"
+
+
+def get_topic_group(org_id, topic):
+    # topics are free form, group names are limited to 100 ascii characters
+    return f"topic_{org_id}_{hashlib.sha256(topic.encode()).hexdigest()[:32]}"
+
+
+def get_topic_groups_cache_key(org_id, user_id):
+    return f"realtime:topic_groups:{org_id}:{user_id}"
+
+
+def get_subscribed_topic_groups(org_id, user_id):
+    # cached so reconnect storms do not turn into subscription queries
+    cache_key = get_topic_groups_cache_key(org_id, user_id)
+    topic_groups = cache.get(cache_key)
+    if topic_groups is None:
+        topic_groups = [
+            get_topic_group(org_id, topic)
+            for topic in ExternalUserSubscription.objects.filter(
+                organization_id=org_id, user_id=user_id
+            ).values_list("topic", flat=True)
+        ]
+        cache.set(cache_key, topic_groups, settings.REALTIME_TOPIC_GROUPS_CACHE_TTL)
+    return set(topic_groups)
+
+
+def invalidate_subscribed_topic_groups(org_id, user_id):
+    cache.delete(get_topic_groups_cache_key(org_id, user_id))
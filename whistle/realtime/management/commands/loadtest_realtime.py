@@ -0,0 +1,285 @@
+import asyncio
+import json
+import math
+import os
+import statistics
+import time
+import uuid
+
+import aiohttp
+from asgiref.sync import sync_to_async
+from channels.layers import DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer, channel_layers
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+
+from external_user.models import ExternalUser
+from notification.models import (
+    Broadcast,
+    BroadcastStatusChoices,
+    Notification,
+    NotificationDelivery,
+    NotificationStatusChoices,
+    get_notification_id,
+)
+from notification.tasks import send_in_app
+from organization.models import Organization
+from realtime.tokens import issue_connection_token
+from whistle import utils
+
+
+class Command(BaseCommand):
+    help = "Opens authenticated websocket connections, pushes in app notifications through send_in_app and reports connect throughput, memory per connection and delivery latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connections", type=int, default=1000)
+        parser.add_argument("--connect-concurrency", type=int, default=100)
+        parser.add_argument("--events", type=int, default=1000)
+        parser.add_argument("--send-concurrency", type=int, default=10)
+        parser.add_argument("--url", default="ws://127.0.0.1:8080/ws/")
+        parser.add_argument(
+            "--in-memory",
+            action="store_true",
+            help="Serve the connections from this process with an in memory channel layer instead of connecting to --url",
+        )
+        parser.add_argument(
+            "--server-pid",
+            type=int,
+            help="Process id of the websocket server to measure memory of, defaults to this process with --in-memory",
+        )
+        parser.add_argument("--timeout", type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        if options["in_memory"]:
+            channel_layers.set(DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer())
+            options["server_pid"] = options["server_pid"] or os.getpid()
+
+        organization = Organization.objects.create(
+            clerk_org_id=f"loadtest_{uuid.uuid4()}",
+            name="loadtest",
+            slug=f"loadtest-{uuid.uuid4()}",
+        )
+        try:
+            users = self.create_users(organization, options["connections"])
+            asyncio.run(self.run(organization, users, options))
+        finally:
+            NotificationDelivery.objects.filter(
+                notification__organization=organization
+            ).delete()
+            Notification.objects.filter(organization=organization).delete()
+            Broadcast.objects.filter(organization=organization).delete()
+            organization.delete()
+
+    def create_users(self, organization, count):
+        users = []
+        for index in range(count):
+            email = f"loadtest-{index}@example.com"
+            users.append(
+                ExternalUser(
+                    organization=organization,
+                    external_id=f"loadtest-{index}",
+                    email=email,
+                    email_hash=utils.perform_hash(email),
+                )
+            )
+        return ExternalUser.objects.bulk_create(users, batch_size=1000)
+
+    async def run(self, organization, users, options):
+        rss_before = get_rss(options["server_pid"])
+        semaphore = asyncio.Semaphore(options["connect_concurrency"])
+        session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, force_close=True)
+        )
+
+        async def connect(user):
+            async with semaphore:
+                # tokens expire quickly so they are issued right before connecting
+                token = issue_connection_token(organization, user)
+                try:
+                    if options["in_memory"]:
+                        client = CommunicatorClient(user)
+                    else:
+                        client = AiohttpClient(user, session, options["url"])
+                    await client.connect(token)
+                except Exception as error:
+                    self.stderr.write(f"  connect failed for {user.id}: {error!r}")
+                    return None
+                return client
+
+        started = time.perf_counter()
+        clients = await asyncio.gather(*(connect(user) for user in users))
+        connect_elapsed = time.perf_counter() - started
+        clients = [client for client in clients if client]
+        rss_after = get_rss(options["server_pid"])
+
+        self.stdout.write(
+            f"connected {len(clients)}/{len(users)} in {connect_elapsed:.2f}s, "
+            f"{len(clients) / connect_elapsed if connect_elapsed else 0:,.0f} connections/s"
+        )
+        if rss_before and rss_after and clients:
+            self.stdout.write(
+                f"server rss: {rss_before / 2**20:.1f} MiB -> {rss_after / 2**20:.1f} MiB, "
+                f"{(rss_after - rss_before) / len(clients) / 1024:.1f} KiB per connection"
+            )
+
+        try:
+            if clients and options["events"]:
+                await self.push_events(organization, clients, options)
+        finally:
+            await asyncio.gather(
+                *(client.close() for client in clients), return_exceptions=True
+            )
+            await session.close()
+
+    async def push_events(self, organization, clients, options):
+        notifications = await sync_to_async(self.create_notifications)(
+            organization, [client.user for client in clients], options["events"]
+        )
+        sent_at = {}
+        latencies = []
+        all_delivered = asyncio.Event()
+
+        def on_event(received_at, event):
+            notification_id = event.get("data", {}).get("id")
+            if notification_id in sent_at:
+                latencies.append(received_at - sent_at.pop(notification_id))
+                if len(latencies) == len(notifications):
+                    all_delivered.set()
+
+        for client in clients:
+            client.on_event = on_event
+
+        semaphore = asyncio.Semaphore(options["send_concurrency"])
+        data = {"title": "Load test", "content": "Load test notification"}
+
+        async def send(notification):
+            async with semaphore:
+                sent_at[str(notification.id)] = time.perf_counter()
+                await sync_to_async(send_in_app.apply, thread_sensitive=False)(
+                    args=(
+                        notification.broadcast_id,
+                        organization.id,
+                        notification.recipient_id,
+                        notification.id,
+                        data,
+                    )
+                )
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(notification) for notification in notifications))
+        send_elapsed = time.perf_counter() - started
+        try:
+            await asyncio.wait_for(all_delivered.wait(), options["timeout"])
+        except asyncio.TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"sent {len(notifications)} events in {send_elapsed:.2f}s, "
+            f"delivered {len(latencies)} in {elapsed:.2f}s"
+        )
+        if len(latencies) > 1:
+            quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+            self.stdout.write(
+                f"delivery latency: p50 {quantiles[49] * 1000:.1f}ms, "
+                f"p99 {quantiles[98] * 1000:.1f}ms, max {max(latencies) * 1000:.1f}ms"
+            )
+
+    def create_notifications(self, organization, users, count):
+        # one broadcast per round so every user gets at most one notification per broadcast
+        notifications = []
+        for _ in range(math.ceil(count / len(users))):
+            broadcast = Broadcast.objects.create(
+                idempotency_id=uuid.uuid4(),
+                organization=organization,
+                title="Load test",
+                content="Load test notification",
+                status=BroadcastStatusChoices.PROCESSED,
+            )
+            for user in users[: count - len(notifications)]:
+                notifications.append(
+                    Notification(
+                        id=get_notification_id(broadcast.id, user.id),
+                        organization=organization,
+                        broadcast=broadcast,
+                        recipient=user,
+                        status=NotificationStatusChoices.PROCESSED,
+                    )
+                )
+        return Notification.objects.bulk_create(notifications, batch_size=1000)
+
+
+class AiohttpClient:
+    def __init__(self, user, session, url):
+        self.user = user
+        self.session = session
+        self.url = url
+        self.on_event = None
+        self.reader = None
+        self.websocket = None
+
+    async def connect(self, token):
+        self.websocket = await self.session.ws_connect(
+            self.url, params={"token": token}, autoping=True
+        )
+        self.reader = asyncio.create_task(self.read())
+
+    async def read(self):
+        async for message in self.websocket:
+            if message.type == aiohttp.WSMsgType.TEXT:
+                dispatch(self, message.data)
+
+    async def close(self):
+        self.reader.cancel()
+        await self.websocket.close()
+
+
+class CommunicatorClient:
+    def __init__(self, user):
+        from whistle.asgi import application
+
+        self.user = user
+        self.on_event = None
+        self.reader = None
+        self.application = application
+        self.communicator = None
+
+    async def connect(self, token):
+        self.communicator = WebsocketCommunicator(
+            self.application, f"/ws/?token={token}"
+        )
+        connected, _ = await self.communicator.connect()
+        if not connected:
+            raise ConnectionError("connection rejected")
+        self.reader = asyncio.create_task(self.read())
+
+    async def read(self):
+        while True:
+            dispatch(self, await self.communicator.receive_from(timeout=None))
+
+    async def close(self):
+        self.reader.cancel()
+        await self.communicator.disconnect()
+
+
+def dispatch(client, text):
+    received_at = time.perf_counter()
+    if client.on_event is None:
+        return
+    payload = json.loads(text)
+    # coalesced frames carry a list of events
+    for event in payload if isinstance(payload, list) else [payload]:
+        if event.get("type") == "notification.created":
+            client.on_event(received_at, event)
+
+
+def get_rss(pid):
+    if not pid:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
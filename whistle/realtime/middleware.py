@@ -1,6 +1,7 @@
 import hashlib
 import hmac
 import logging
+import uuid
 from urllib.parse import parse_qs
 
 from channels.db import database_sync_to_async
@@ -8,12 +9,24 @@ from django.conf import settings
 from jwt import PyJWKClient
 
 from external_user.models import ExternalUser
-from organization.models import OrganizationCredentials
+from organization.credentials import get_cached_credentials
+from realtime.tokens import verify_connection_token
 from whistle import utils
 
 jwks_client = PyJWKClient(settings.JWKS_ENDPOINT_URL)
 
 
+class ConnectionPrincipal:
+    __slots__ = ("org_id", "user_id")
+
+    def __init__(self, org_id, user_id):
+        self.org_id = org_id
+        self.user_id = user_id
+
+    def __repr__(self):
+        return f"<ConnectionPrincipal: {self.org_id} {self.user_id}>"
+
+
 class ClientAuthMiddleware:
     def __init__(self, app):
         self.app = app
@@ -21,7 +34,21 @@ class ClientAuthMiddleware:
     async def __call__(self, scope, receive, send):
         params = parse_qs(scope["query_string"])
         headers = dict(scope["headers"])
-        if (
+        if b"token" in params:
+            if b"sec-websocket-protocol" in headers:
+                scope["api_key"] = headers[b"sec-websocket-protocol"].decode()
+            claims = verify_connection_token(params[b"token"][0].decode())
+            if claims:
+                # the signed claims are trusted as is, no database access needed
+                scope["principal"] = ConnectionPrincipal(
+                    uuid.UUID(claims["org"]), uuid.UUID(claims["user"])
+                )
+            else:
+                scope["error_code"] = "invalid_connection_token"
+                scope["error_reason"] = (
+                    "Connection token invalid or expired. Please request a new connection token."
+                )
+        elif (
             b"sec-websocket-protocol" in headers
             and b"external_id" in params
             and b"external_id_hmac" in params
@@ -39,12 +66,14 @@ class ClientAuthMiddleware:
                     hashlib.sha256,
                 ).hexdigest()
                 if external_id_check == external_id_hmac:
-                    external_user = await get_external_user(
-                        organization=credentials.organization, external_id=external_id
+                    external_user_id = await get_external_user_id(
+                        organization_id=credentials.organization.id,
+                        external_id=external_id,
                     )
-                    if external_user:
-                        scope["external_user"] = external_user
-                        scope["org"] = credentials.organization
+                    if external_user_id:
+                        scope["principal"] = ConnectionPrincipal(
+                            credentials.organization.id, external_user_id
+                        )
                     else:
                         scope["error_code"] = "user_not_found"
                         scope["error_reason"] = (
@@ -95,17 +124,9 @@ class ClientAuthMiddleware:
 
 @database_sync_to_async
 def get_organization_credentials(**kwargs):
-    try:
-        return OrganizationCredentials.objects.select_related("organization").get(
-            **kwargs
-        )
-    except OrganizationCredentials.DoesNotExist:
-        return None
+    return get_cached_credentials(**kwargs)
 
 
 @database_sync_to_async
-def get_external_user(**kwargs):
-    try:
-        return ExternalUser.objects.get(**kwargs)
-    except ExternalUser.DoesNotExist:
-        return None
+def get_external_user_id(**kwargs):
+    return ExternalUser.objects.filter(**kwargs).values_list("id", flat=True).first()
@@ -0,0 +1,64 @@
+import logging
+import time
+
+import redis
+from django.conf import settings
+
+from whistle.cache import redis_client, async_redis_client
+
+
+def get_presence_key(user_id):
+    return f"presence:user:{user_id}"
+
+
+async def mark_online(user_id, channel_name):
+    key = get_presence_key(user_id)
+    now = time.time()
+    # one member per socket, scored by when it stops counting as online
+    try:
+        pipe = async_redis_client.pipeline(transaction=False)
+        pipe.zadd(key, {channel_name: now + settings.REALTIME_PRESENCE_TTL})
+        pipe.zremrangebyscore(key, 0, now)
+        pipe.expire(key, settings.REALTIME_PRESENCE_TTL)
+        await pipe.execute()
+    except redis.RedisError as error:
+        logging.warning(
+            "Presence update failed for user: %s with error: %s", user_id, error
+        )
+
+
+async def mark_offline(user_id, channel_name):
+    # the socket keeps counting as online for a grace period so that events sent
+    # while a client reconnects are still logged for replay
+    try:
+        await async_redis_client.zadd(
+            get_presence_key(user_id),
+            {channel_name: time.time() + settings.REALTIME_PRESENCE_GRACE_PERIOD},
+            xx=True,
+        )
+    except redis.RedisError as error:
+        logging.warning(
+            "Presence removal failed for user: %s with error: %s", user_id, error
+        )
+
+
+def get_online_user_ids(user_ids):
+    user_ids = list(user_ids)
+    if not user_ids:
+        return set()
+
+    now = time.time()
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.zcount(get_presence_key(user_id), now, "+inf")
+        counts = pipe.execute()
+    except redis.RedisError as error:
+        # fail open, an unnecessary publish is cheaper than a missed one
+        logging.warning("Presence lookup failed with error: %s", error)
+        return set(user_ids)
+    return {user_id for user_id, count in zip(user_ids, counts) if count}
+
+
+def is_online(user_id):
+    return user_id in get_online_user_ids([user_id])
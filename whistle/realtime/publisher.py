@@ -0,0 +1,150 @@
+import asyncio
+import collections
+import logging
+import time
+
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+
+# unlike channels_redis' group send script, a channel key may appear more than once
+# because every user in the batch gets its own message. a group's message with an event id
+# is written to a channel at most once, so a retried batch skips the shards it already reached
+group_send_many_lua = """
+    local over_capacity = 0
+    local count = #KEYS
+    local current_time = ARGV[3 * count + 1]
+    local expiry = ARGV[3 * count + 2]
+    local sent_expiry = ARGV[3 * count + 3]
+    for i=1,count do
+        local sent_id = ARGV[2 * count + i]
+        if sent_id ~= '' and not redis.call('SET', KEYS[i] .. ':sent:' .. sent_id, 1, 'NX', 'EX', sent_expiry) then
+            -- already written by an earlier attempt
+        elseif redis.call('ZCOUNT', KEYS[i], '-inf', '+inf') < tonumber(ARGV[count + i]) then
+            redis.call('ZADD', KEYS[i], current_time, ARGV[i])
+            redis.call('EXPIRE', KEYS[i], expiry)
+        else
+            over_capacity = over_capacity + 1
+        end
+    end
+    return over_capacity
+"""
+
+
+async def group_send_many(channel_layer, messages, chunk_size=500):
+    if not isinstance(channel_layer, RedisChannelLayer):
+        for group, message in messages:
+            await channel_layer.group_send(group, message)
+        return
+
+    group_channels = await get_group_channels(
+        channel_layer, [group for group, _ in messages]
+    )
+
+    channel_keys = collections.defaultdict(list)
+    payloads = collections.defaultdict(list)
+    capacities = collections.defaultdict(list)
+    sent_ids = collections.defaultdict(list)
+    for group, message in messages:
+        if not group_channels[group]:
+            continue
+        (
+            connection_to_channel_keys,
+            channel_keys_to_message,
+            channel_keys_to_capacity,
+        ) = channel_layer._map_channel_keys_to_connection(
+            group_channels[group], message
+        )
+        for index, keys in connection_to_channel_keys.items():
+            for key in keys:
+                channel_keys[index].append(key)
+                payloads[index].append(channel_keys_to_message[key])
+                capacities[index].append(channel_keys_to_capacity[key])
+                # stream ids are only unique per user, so the group is part of the id
+                sent_ids[index].append(
+                    f"{group}:{message['event_id']}" if "event_id" in message else ""
+                )
+
+    # shards are independent redis instances and are written to concurrently
+    await asyncio.gather(
+        *(
+            send_to_shard(
+                channel_layer,
+                index,
+                keys,
+                payloads[index],
+                capacities[index],
+                sent_ids[index],
+                chunk_size,
+            )
+            for index, keys in channel_keys.items()
+        )
+    )
+
+
+async def send_to_shard(
+    channel_layer, index, keys, payloads, capacities, sent_ids, chunk_size
+):
+    connection = channel_layer.connection(index)
+
+    pipe = connection.pipeline(transaction=False)
+    for key in set(keys):
+        pipe.zremrangebyscore(
+            key, min=0, max=int(time.time()) - int(channel_layer.expiry)
+        )
+    await pipe.execute()
+
+    for offset in range(0, len(keys), chunk_size):
+        chunk = keys[offset : offset + chunk_size]
+        over_capacity = await connection.eval(
+            group_send_many_lua,
+            len(chunk),
+            *chunk,
+            *payloads[offset : offset + chunk_size],
+            *capacities[offset : offset + chunk_size],
+            *sent_ids[offset : offset + chunk_size],
+            time.time(),
+            channel_layer.expiry,
+            settings.REALTIME_EVENT_LOG_TTL,
+        )
+        if over_capacity > 0:
+            logging.info(
+                "%s of %s channels over capacity in batched group send on shard: %s",
+                over_capacity,
+                len(chunk),
+                index,
+            )
+
+
+async def get_group_channels(channel_layer, groups):
+    # placement follows the layer's own hashing so consumers and publishers agree
+    groups_by_connection = collections.defaultdict(list)
+    for group in set(groups):
+        assert channel_layer.valid_group_name(group), "Group name not valid"
+        groups_by_connection[channel_layer.consistent_hash(group)].append(group)
+
+    results = await asyncio.gather(
+        *(
+            get_shard_group_channels(channel_layer, index, connection_groups)
+            for index, connection_groups in groups_by_connection.items()
+        )
+    )
+
+    group_channels = {}
+    for shard_group_channels in results:
+        group_channels.update(shard_group_channels)
+    return group_channels
+
+
+async def get_shard_group_channels(channel_layer, index, groups):
+    pipe = channel_layer.connection(index).pipeline(transaction=False)
+    for group in groups:
+        key = channel_layer._group_key(group)
+        pipe.zremrangebyscore(
+            key, min=0, max=int(time.time()) - channel_layer.group_expiry
+        )
+        pipe.zrange(key, 0, -1)
+    results = await pipe.execute()
+    return {
+        group: [name.decode() for name in channel_names]
+        for group, channel_names in zip(groups, results[1::2])
+    }
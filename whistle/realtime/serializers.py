@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.db import models
+from rest_framework import serializers
+
+from realtime.events import EVENT_ID_PATTERN
+
+
+class ConnectionTokenSerializer(serializers.Serializer):
+    token = serializers.CharField(read_only=True)
+    expires_in = serializers.IntegerField(read_only=True)
+
+
+class RealtimeMessageActionChoices(models.TextChoices):
+    ACK = "ack", "ack"
+    SEEN = "seen", "seen"
+    READ = "read", "read"
+    CLICKED = "clicked", "clicked"
+
+
+class RealtimeMessageSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=RealtimeMessageActionChoices.choices)
+    ids = serializers.ListField(
+        child=serializers.UUIDField(),
+        min_length=1,
+        max_length=settings.MAX_INBOX_BULK_UPDATE_IDS,
+        required=False,
+    )
+    event_id = serializers.RegexField(EVENT_ID_PATTERN, required=False)
+
+    def validate(self, attrs):
+        if attrs["action"] == RealtimeMessageActionChoices.ACK:
+            if "event_id" not in attrs:
+                raise serializers.ValidationError(
+                    "Please provide the event_id of the last received event.",
+                    "missing_event_id",
+                )
+        elif "ids" not in attrs:
+            raise serializers.ValidationError(
+                "Please provide a list of notification ids.", "missing_ids"
+            )
+        return attrs
@@ -0,0 +1,49 @@
+import os
+
+import django
+
+# daphne.server installs the asyncio reactor and has to be imported before twisted
+from daphne.server import Server as DaphneServer
+from daphne.cli import CommandLineInterface as DaphneCommandLineInterface
+
+from autobahn.websocket.compress import (
+    PerMessageDeflateOffer,
+    PerMessageDeflateOfferAccept,
+)
+from django.conf import settings
+from twisted.internet import reactor
+
+
+def accept_compression(offers):
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            window_bits = settings.REALTIME_COMPRESSION_WINDOW_BITS
+            if offer.request_max_window_bits:
+                window_bits = min(window_bits, offer.request_max_window_bits)
+            # a smaller window keeps the per connection zlib context small
+            return PerMessageDeflateOfferAccept(offer, window_bits=window_bits)
+    return None
+
+
+class Server(DaphneServer):
+    def run(self):
+        if settings.REALTIME_WEBSOCKET_COMPRESSION:
+            reactor.callWhenRunning(self.enable_compression)
+        super().run()
+
+    def enable_compression(self):
+        self.ws_factory.setProtocolOptions(
+            perMessageCompressionAccept=accept_compression
+        )
+
+
+class CommandLineInterface(DaphneCommandLineInterface):
+    server_class = Server
+
+
+if __name__ == "__main__":
+    # this module is the process entrypoint, Django is only configured once daphne
+    # imports the ASGI application, so set it up first to read the compression settings
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "whistle.settings")
+    django.setup()
+    CommandLineInterface.entrypoint()
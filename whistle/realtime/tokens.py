@@ -0,0 +1,25 @@
+import logging
+
+from django.conf import settings
+from django.core import signing
+
+CONNECTION_TOKEN_SALT = "realtime.connection"
+
+
+def issue_connection_token(org, external_user):
+    return signing.dumps(
+        {"org": str(org.id), "user": str(external_user.id)},
+        salt=CONNECTION_TOKEN_SALT,
+    )
+
+
+def verify_connection_token(token):
+    try:
+        return signing.loads(
+            token,
+            salt=CONNECTION_TOKEN_SALT,
+            max_age=settings.REALTIME_CONNECTION_TOKEN_MAX_AGE,
+        )
+    except signing.BadSignature as error:
+        logging.debug("Connection token invalid with error: %s", error)
+        return None
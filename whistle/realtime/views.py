@@ -1 +1,225 @@
-# Create your views here.
+import asyncio
+import json
+import logging
+import uuid
+
+import redis
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.views import View
+from drf_spectacular.utils import extend_schema
+from rest_framework import status
+from rest_framework.exceptions import (
+    APIException,
+    AuthenticationFailed,
+    NotAuthenticated,
+    PermissionDenied,
+    ValidationError,
+)
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.viewsets import GenericViewSet
+
+from realtime.events import (
+    EVENT_ID_PATTERN,
+    build_broadcast_event,
+    parse_event_id,
+    read_events_since,
+)
+from realtime.groups import get_user_group, get_org_group, get_subscribed_topic_groups
+from realtime.middleware import ConnectionPrincipal
+from realtime.presence import mark_online, mark_offline
+from realtime.serializers import ConnectionTokenSerializer
+from realtime.tokens import issue_connection_token, verify_connection_token
+from whistle.auth import ClientAuth, IsValidExternalId, get_external_user
+from whistle.exceptions import generate_error_response
+
+
+class ConnectionTokenViewSet(GenericViewSet):
+    serializer_class = ConnectionTokenSerializer
+    authentication_classes = [ClientAuth]
+    permission_classes = [IsValidExternalId]
+
+    @extend_schema(request=None, responses={201: ConnectionTokenSerializer})
+    def create(self, request, **kwargs):
+        external_user = get_external_user(request)
+        serializer = self.get_serializer(
+            {
+                "token": issue_connection_token(request.user, external_user),
+                "expires_in": settings.REALTIME_CONNECTION_TOKEN_MAX_AGE,
+            }
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
+class NotificationStreamView(View):
+    async def get(self, request):
+        # wsgi reads the whole stream before responding and would hold a worker for it
+        if not isinstance(request, ASGIRequest):
+            return generate_error_response(
+                code="streaming_not_supported",
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Event streams are only served by the realtime server.",
+            )
+
+        try:
+            principal = await database_sync_to_async(authenticate_stream)(request)
+        except APIException as error:
+            return stream_error_response(error)
+
+        last_event_id = request.headers.get("Last-Event-ID") or request.GET.get(
+            "last_event_id"
+        )
+        if last_event_id and not EVENT_ID_PATTERN.match(last_event_id):
+            return generate_error_response(
+                code="invalid_last_event_id",
+                detail="Invalid last event ID. Please provide the event_id of the last received event.",
+            )
+
+        response = StreamingHttpResponse(
+            stream_events(principal, last_event_id), content_type="text/event-stream"
+        )
+        response["Cache-Control"] = "no-cache"
+        # stops proxies from buffering the stream
+        response["X-Accel-Buffering"] = "no"
+        return response
+
+
+def stream_error_response(error):
+    # mirrors custom_exception_handler for the plain django view
+    detail = error.detail[0] if isinstance(error.detail, list) else error.detail
+    if isinstance(error, ValidationError):
+        return generate_error_response(code=detail.code, detail=detail)
+    return generate_error_response(
+        (
+            "permission_error"
+            if isinstance(error, PermissionDenied)
+            else "authentication_error"
+        ),
+        detail.code,
+        status.HTTP_401_UNAUTHORIZED,
+        detail,
+    )
+
+
+def authenticate_stream(request):
+    # EventSource cannot set headers, browsers authenticate with a connection token
+    if "token" in request.GET:
+        claims = verify_connection_token(request.GET["token"])
+        if not claims:
+            raise AuthenticationFailed(
+                "Connection token invalid or expired. Please request a new connection token.",
+                "invalid_connection_token",
+            )
+        return ConnectionPrincipal(uuid.UUID(claims["org"]), uuid.UUID(claims["user"]))
+
+    if "Authorization" not in request.headers and "X-API-Key" not in request.headers:
+        raise NotAuthenticated(
+            "API key invalid. You can find your API key in Whistle settings.",
+            "invalid_api_key",
+        )
+    drf_request = Request(request, authenticators=[ClientAuth()])
+    permission = IsValidExternalId()
+    if not permission.has_permission(drf_request, None):
+        raise PermissionDenied(permission.message, permission.code)
+    external_user = get_external_user(drf_request)
+    return ConnectionPrincipal(drf_request.user.id, external_user.id)
+
+
+def format_event(event):
+    lines = [f"id: {event['event_id']}"] if "event_id" in event else []
+    lines.append(f"data: {json.dumps(event)}")
+    return "\n".join(lines) + "\n\n"
+
+
+async def stream_events(principal, last_event_id):
+    channel_layer = get_channel_layer()
+    channel_name = await channel_layer.new_channel()
+    groups = {get_user_group(principal.user_id), get_org_group(principal.org_id)}
+    topic_groups = await database_sync_to_async(get_subscribed_topic_groups)(
+        principal.org_id, principal.user_id
+    )
+    for group in groups | topic_groups:
+        await channel_layer.group_add(group, channel_name)
+    await mark_online(principal.user_id, channel_name)
+    logging.info(
+        "Event stream opened on channel: %s for user: %s and org: %s",
+        channel_name,
+        principal.user_id,
+        principal.org_id,
+    )
+
+    try:
+        if last_event_id:
+            try:
+                events, truncated = await read_events_since(
+                    principal.user_id,
+                    last_event_id,
+                    [get_org_group(principal.org_id), *topic_groups],
+                )
+            except redis.RedisError as error:
+                logging.warning(
+                    "Replay failed for channel: %s with error: %s", channel_name, error
+                )
+                events, truncated = [], True
+            if truncated:
+                # older events are gone, the client should refetch its inbox
+                yield format_event({"object": "event", "type": "events.truncated"})
+            for event in events:
+                yield format_event(event)
+            if events:
+                last_event_id = events[-1]["event_id"]
+
+        loop = asyncio.get_running_loop()
+        # streams are recycled so long lived clients rebalance across servers
+        closes_at = loop.time() + settings.REALTIME_SSE_MAX_DURATION
+        heartbeat_at = loop.time() + settings.REALTIME_PRESENCE_HEARTBEAT_INTERVAL
+        while loop.time() < closes_at:
+            if loop.time() >= heartbeat_at:
+                await mark_online(principal.user_id, channel_name)
+                heartbeat_at = (
+                    loop.time() + settings.REALTIME_PRESENCE_HEARTBEAT_INTERVAL
+                )
+
+            try:
+                message = await asyncio.wait_for(
+                    channel_layer.receive(channel_name),
+                    settings.REALTIME_SSE_KEEPALIVE_INTERVAL,
+                )
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+
+            if message["type"] in ("notification.created", "broadcast.created"):
+                if last_event_id and "event_id" in message:
+                    # already delivered by the replay
+                    if parse_event_id(message["event_id"]) <= parse_event_id(
+                        last_event_id
+                    ):
+                        continue
+            if message["type"] == "notification.created":
+                yield format_event(message)
+            elif message["type"] == "broadcast.created":
+                yield format_event(build_broadcast_event(message, principal.user_id))
+            elif message["type"] == "subscriptions.changed":
+                subscribed = await database_sync_to_async(get_subscribed_topic_groups)(
+                    principal.org_id, principal.user_id
+                )
+                for group in subscribed - topic_groups:
+                    await channel_layer.group_add(group, channel_name)
+                for group in topic_groups - subscribed:
+                    await channel_layer.group_discard(group, channel_name)
+                topic_groups = subscribed
+    finally:
+        await mark_offline(principal.user_id, channel_name)
+        for group in groups | topic_groups:
+            await channel_layer.group_discard(group, channel_name)
+        logging.debug(
+            "Event stream closed on channel: %s for user: %s and org: %s",
+            channel_name,
+            principal.user_id,
+            principal.org_id,
+        )
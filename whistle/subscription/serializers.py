@@ -3,11 +3,11 @@ import logging
 from django.db import transaction
 from rest_framework import serializers
 
-from external_user.models import ExternalUser
 from subscription.models import (
     ExternalUserSubscription,
     ExternalUserSubscriptionCategory,
 )
+from whistle.auth import get_external_user
 
 
 class ExternalUserSubscriptionCategorySerializer(serializers.ModelSerializer):
@@ -26,42 +26,29 @@ class ExternalUserSubscriptionSerializer(serializers.ModelSerializer):
     @transaction.atomic
     def create(self, validated_data):
         org = self.context["request"].user
-        external_id = self.context.get("external_id")
-        try:
-            category_data = validated_data.pop("categories", [])
-            external_user = ExternalUser.objects.get(external_id=external_id)
-            user_subscription = ExternalUserSubscription.objects.create(
-                organization=org, user=external_user, topic=validated_data["topic"]
-            )
-
-            for cat in category_data:
-                ExternalUserSubscriptionCategory.objects.create(
-                    user_subscription=user_subscription, **cat
-                )
+        category_data = validated_data.pop("categories", [])
+        external_user = get_external_user(self.context["request"])
+        user_subscription = ExternalUserSubscription.objects.create(
+            organization=org, user=external_user, topic=validated_data["topic"]
+        )
 
-            logging.info(
-                "Subscription with id: %s created for user: %s in org: %s",
-                user_subscription.id,
-                external_user.id,
-                org.id,
+        for cat in category_data:
+            ExternalUserSubscriptionCategory.objects.create(
+                user_subscription=user_subscription, **cat
             )
 
-            return user_subscription
-        except ExternalUser.DoesNotExist:
-            logging.error(
-                "Invalid external id: %s provided for org: %s while creating subscription",
-                external_id,
-                self.request.user.id,
-            )
-            raise serializers.ValidationError(
-                "Invalid External Id. Please provide a valid External Id in the request header.",
-                "invalid_external_id",
-            )
+        logging.info(
+            "Subscription with id: %s created for user: %s in org: %s",
+            user_subscription.id,
+            external_user.id,
+            org.id,
+        )
+
+        return user_subscription
 
     @transaction.atomic
     def update(self, instance, validated_data, **kwargs):
         org = self.context["request"].user
-        external_id = self.context.get("external_id")
         category_data = validated_data.pop("categories", [])
         instance.channel = validated_data.get("slug", instance.channel)
         instance.save()
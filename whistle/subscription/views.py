@@ -1,12 +1,13 @@
-import logging
-
-from rest_framework.exceptions import ValidationError
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
 from rest_framework.viewsets import ModelViewSet
 
-from external_user.models import ExternalUser
+from realtime.groups import get_user_group, invalidate_subscribed_topic_groups
+
 from subscription.models import ExternalUserSubscription
 from subscription.serializers import ExternalUserSubscriptionSerializer
-from whistle.auth import ClientAuth, IsValidExternalId
+from whistle.auth import ClientAuth, IsValidExternalId, get_external_user
 from whistle.pagination import StandardLimitOffsetPagination
 
 
@@ -18,25 +19,30 @@ class SubscriptionViewSet(ModelViewSet):
     pagination_class = StandardLimitOffsetPagination
 
     def get_queryset(self):
-        external_id = self.request.headers.get("X-External-Id")
-        try:
-            user = ExternalUser.objects.get(
-                external_id=external_id,
-                organization=self.request.user,
-            )
-        except ExternalUser.DoesNotExist:
-            logging.error(
-                "Invalid external id: %s provided for org: %s while querying subscriptions",
-                external_id,
-                self.request.user.id,
-            )
-            raise ValidationError(
-                "Invalid External Id. Please provide a valid External Id in the request header.",
-                "invalid_external_id",
-            )
+        user = get_external_user(self.request)
         return self.queryset.filter(user=user)
 
-    def get_serializer_context(self):
-        context = super().get_serializer_context()
-        context.update({"external_id": self.request.headers.get("X-External-Id")})
-        return context
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        self.notify_subscriptions_changed()
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        self.notify_subscriptions_changed()
+
+    def perform_destroy(self, instance):
+        super().perform_destroy(instance)
+        self.notify_subscriptions_changed()
+
+    def notify_subscriptions_changed(self):
+        # open sockets re-sync their topic groups
+        org_id = self.request.user.id
+        user_id = get_external_user(self.request).id
+        transaction.on_commit(lambda: subscriptions_changed(org_id, user_id))
+
+
+def subscriptions_changed(org_id, user_id):
+    invalidate_subscribed_topic_groups(org_id, user_id)
+    async_to_sync(get_channel_layer().group_send)(
+        get_user_group(user_id), {"type": "subscriptions.changed"}
+    )
@@ -1,15 +1,21 @@
 import hashlib
 import hmac
+import json
 import logging
+import time
 
 import jwt
+import redis
 from django.conf import settings
-from django.db import transaction
+from django.core.cache import cache
+from django.db import transaction, DEFAULT_DB_ALIAS
 from jwt import PyJWKClient
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import ValidationError, AuthenticationFailed
 from rest_framework.permissions import BasePermission
 
+from external_user.models import ExternalUser
+from organization.credentials import get_cached_credentials, organization_fields
 from organization.models import Organization, OrganizationCredentials
 from organization.models import OrganizationMember
 from user.models import User
@@ -39,11 +45,7 @@ class ServerAuth(BaseAuthentication):
                     algorithms=["RS256"],
                 )
 
-                user = update_or_create_user(data)
-
-                org = update_or_create_organization(data)
-
-                member = update_or_create_organization_member(data, user, org)
+                org = resolve_principal(data)
 
                 return org, None
             except jwt.PyJWTError as error:
@@ -72,11 +74,14 @@ class ServerAuth(BaseAuthentication):
                     "missing_api_secret",
                 )
             else:
-                try:
-                    api_key_hash = utils.perform_hash(api_key)
-                    credentials = OrganizationCredentials.objects.select_related(
-                        "organization"
-                    ).get(api_key_hash=api_key_hash)
+                api_key_hash = utils.perform_hash(api_key)
+                credentials = get_cached_credentials(api_key_hash=api_key_hash)
+                if credentials is None:
+                    raise AuthenticationFailed(
+                        "API key invalid. You can find your API key in Whistle settings.",
+                        "invalid_api_key",
+                    )
+                else:
                     api_secret_hash = utils.perform_hash(
                         api_secret, credentials.api_secret_salt
                     )
@@ -91,11 +96,6 @@ class ServerAuth(BaseAuthentication):
                         )
                     else:
                         return credentials.organization, None
-                except OrganizationCredentials.DoesNotExist:
-                    raise AuthenticationFailed(
-                        "API key invalid. You can find your API key in Whistle settings.",
-                        "invalid_api_key",
-                    )
 
 
 class ClientAuth(BaseAuthentication):
@@ -118,11 +118,7 @@ class ClientAuth(BaseAuthentication):
                     algorithms=["RS256"],
                 )
 
-                user = update_or_create_user(data)
-
-                org = update_or_create_organization(data)
-
-                member = update_or_create_organization_member(data, user, org)
+                org = resolve_principal(data)
 
                 return org, None
             except jwt.PyJWTError:
@@ -134,12 +130,10 @@ class ClientAuth(BaseAuthentication):
         else:
             api_key = request.headers.get("X-API-Key")
             api_key_hash = utils.perform_hash(api_key)
-            try:
-                credentials = OrganizationCredentials.objects.select_related(
-                    "organization"
-                ).get(api_key_hash=api_key_hash)
+            credentials = get_cached_credentials(api_key_hash=api_key_hash)
+            if credentials is not None:
                 return credentials.organization, None
-            except OrganizationCredentials.DoesNotExist:
+            else:
                 logging.debug("Invalid API Key provided")
                 raise AuthenticationFailed(
                     "API key invalid. You can find your API key in Whistle settings.",
@@ -152,7 +146,7 @@ class IsValidExternalId(BasePermission):
     def has_permission(self, request, view):
         external_id = request.headers.get("X-External-Id")
         external_id_hmac = request.headers.get("X-External-Id-Hmac")
-        credentials = OrganizationCredentials.objects.get(organization=request.user)
+        credentials = get_cached_credentials(organization_id=request.user.id)
         if external_id or external_id_hmac:
             external_id_check = hmac.new(
                 credentials.api_secret.encode(), external_id.encode(), hashlib.sha256
@@ -184,8 +178,122 @@ class IsValidExternalId(BasePermission):
             return False
 
 
+def get_external_user(request):
+    if hasattr(request, "_external_user"):
+        return request._external_user
+
+    org = request.user
+    external_id = request.headers.get("X-External-Id")
+    # shared across workers so a delete is seen everywhere at once
+    cache_key = get_external_user_cache_key(org.id, external_id)
+    try:
+        user_id = cache.get(cache_key)
+    except redis.RedisError as error:
+        logging.warning("External user cache read failed with error: %s", error)
+        user_id = None
+    if user_id is None:
+        user_id = (
+            ExternalUser.objects.filter(organization=org, external_id=external_id)
+            .values_list("id", flat=True)
+            .first()
+        )
+        if user_id is None:
+            logging.error(
+                "Invalid external id: %s provided for org: %s",
+                external_id,
+                org.id,
+            )
+            raise ValidationError(
+                "Invalid External Id. Please provide a valid External Id in the request header.",
+                "invalid_external_id",
+            )
+        try:
+            cache.set(cache_key, user_id, settings.EXTERNAL_USER_CACHE_TTL)
+        except redis.RedisError as error:
+            logging.warning("External user cache write failed with error: %s", error)
+
+    # remaining fields, encrypted ones included, are loaded on first access
+    request._external_user = ExternalUser.from_db(
+        DEFAULT_DB_ALIAS,
+        ["id", "organization_id", "external_id"],
+        [user_id, org.id, external_id],
+    )
+    return request._external_user
+
+
+def get_external_user_cache_key(organization_id, external_id):
+    external_id_hash = hashlib.sha256(external_id.encode()).hexdigest()
+    return f"external_user:{organization_id}:{external_id_hash}"
+
+
+def invalidate_external_user(organization_id, external_id):
+    cache_key = get_external_user_cache_key(organization_id, external_id)
+    transaction.on_commit(lambda: delete_cached_external_user(cache_key))
+
+
+def delete_cached_external_user(cache_key):
+    try:
+        cache.delete(cache_key)
+    except redis.RedisError as error:
+        logging.warning("External user cache delete failed with error: %s", error)
+
+
+principal_claims = ["user_id", "org_id", "org_slug", "org_name", "org_role"]
+
+
+def get_principal_cache_key(data):
+    claims = json.dumps([data.get(claim) for claim in principal_claims])
+    return f"auth:principal:{hashlib.sha256(claims.encode()).hexdigest()}"
+
+
+def resolve_principal(data):
+    cache_key = get_principal_cache_key(data)
+    try:
+        values = cache.get(cache_key)
+    except redis.RedisError as error:
+        logging.warning("Principal cache read failed with error: %s", error)
+        values = None
+    if isinstance(values, dict):
+        # plain values survive model changes, unlike a pickled instance
+        return Organization.from_db(
+            DEFAULT_DB_ALIAS,
+            organization_fields,
+            [values[name] for name in organization_fields],
+        )
+
+    user = update_or_create_user(data)
+
+    org = update_or_create_organization(data)
+
+    update_or_create_organization_member(data, user, org)
+
+    timeout = settings.JWT_PRINCIPAL_CACHE_TIMEOUT
+    if "exp" in data:
+        timeout = min(timeout, int(data["exp"] - time.time()))
+    if timeout > 0:
+        try:
+            cache.set(
+                cache_key,
+                {name: getattr(org, name) for name in organization_fields},
+                timeout,
+            )
+        except redis.RedisError as error:
+            logging.warning("Principal cache write failed with error: %s", error)
+    return org
+
+
+def update_fields(instance, values):
+    changed = [
+        name for name, value in values.items() if getattr(instance, name) != value
+    ]
+    if changed:
+        for name in changed:
+            setattr(instance, name, values[name])
+        instance.save(update_fields=changed)
+
+
 def update_or_create_user(data):
-    user, user_created = User.objects.update_or_create(clerk_user_id=data["user_id"])
+    user, user_created = User.objects.get_or_create(clerk_user_id=data["user_id"])
 
     if user_created:
         logging.info("New user with clerk id: %s synced.", user.clerk_user_id)
@@ -195,9 +303,9 @@ def update_or_create_user(data):
 
 @transaction.atomic
 def update_or_create_organization(data):
-    org, org_created = Organization.objects.update_or_create(
-        clerk_org_id=data["org_id"],
-        defaults={"slug": data["org_slug"], "name": data["org_name"]},
+    values = {"slug": data["org_slug"], "name": data["org_name"]}
+    org, org_created = Organization.objects.get_or_create(
+        clerk_org_id=data["org_id"], defaults=values
     )
     if org_created:
         (
@@ -214,12 +322,15 @@ def update_or_create_organization(data):
         )
 
         logging.info("New organization with clerk id: %s synced.", data["org_id"])
+    else:
+        update_fields(org, values)
     return org
 
 
 def update_or_create_organization_member(data, user, org):
-    org_member, org_member_created = OrganizationMember.objects.update_or_create(
-        organization=org, user=user, defaults={"role": data["org_role"]}
+    values = {"role": data["org_role"]}
+    org_member, org_member_created = OrganizationMember.objects.get_or_create(
+        organization=org, user=user, defaults=values
     )
 
     if org_member_created:
@@ -228,5 +339,7 @@ def update_or_create_organization_member(data, user, org):
             user.clerk_user_id,
             org.clerk_org_id,
         )
+    else:
+        update_fields(org_member, values)
 
     return org_member
@@ -0,0 +1,7 @@
+import redis
+import redis.asyncio
+from django.conf import settings
+
+redis_client = redis.Redis.from_url(settings.REDIS_CACHE_URL)
+
+async_redis_client = redis.asyncio.Redis.from_url(settings.REDIS_CACHE_URL)
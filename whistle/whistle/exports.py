@@ -0,0 +1,57 @@
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from drf_spectacular.types import OpenApiTypes
+from drf_spectacular.utils import OpenApiResponse
+
+export_response_schema = {
+    (200, "application/x-ndjson"): OpenApiResponse(
+        OpenApiTypes.BINARY,
+        description="One JSON object per line, gzip encoded when the client accepts it.",
+    )
+}
+
+
+def stream_ndjson(rows, compress=False):
+    # gzip framing, unlike a raw deflate stream
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) if compress else None
+    encoder = DjangoJSONEncoder()
+    lines = []
+    size = 0
+    for row in rows:
+        line = encoder.encode(row)
+        lines.append(line)
+        size += len(line) + 1
+        if size >= settings.EXPORT_BUFFER_SIZE:
+            data = encode_lines(lines, compressor)
+            lines = []
+            size = 0
+            if data:
+                yield data
+
+    data = encode_lines(lines, compressor)
+    if compressor:
+        data += compressor.flush()
+    if data:
+        yield data
+
+
+def encode_lines(lines, compressor):
+    if not lines:
+        return b""
+    data = ("\n".join(lines) + "\n").encode()
+    return compressor.compress(data) if compressor else data
+
+
+def export_response(request, rows, filename):
+    compress = "gzip" in request.headers.get("Accept-Encoding", "")
+    response = StreamingHttpResponse(
+        stream_ndjson(rows, compress), content_type="application/x-ndjson"
+    )
+    response["Content-Disposition"] = f'attachment; filename="{filename}.ndjson"'
+    response["Vary"] = "Accept-Encoding"
+    if compress:
+        response["Content-Encoding"] = "gzip"
+    return response
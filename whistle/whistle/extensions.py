@@ -2,6 +2,7 @@ from drf_spectacular.extensions import OpenApiAuthenticationExtension
 from drf_spectacular.openapi import AutoSchema
 
 from whistle.auth import ClientAuth, ServerAuth
+from whistle.fieldsets import SparseFieldsetMixin
 
 exclude_paths = [
     "/api/v1/organizations",
@@ -52,6 +53,34 @@ class CustomOpenApiSettings(AutoSchema):
                             },
                         ]
                     )
+
+        if isinstance(self.view, SparseFieldsetMixin) and (
+            self.view.action in self.view.sparse_fieldset_actions
+        ):
+            parameters.extend(
+                [
+                    {
+                        "name": self.view.fields_query_param,
+                        "in": "query",
+                        "description": "Comma separated list of fields to return. Nested fields can be selected "
+                        "with dot notation, for example 'recipient.external_id'.",
+                        "required": False,
+                        "schema": {
+                            "type": "string",
+                        },
+                    },
+                    {
+                        "name": self.view.expand_query_param,
+                        "in": "query",
+                        "description": "Comma separated list of related objects to expand. Related objects that "
+                        "are not expanded are returned as IDs.",
+                        "required": False,
+                        "schema": {
+                            "type": "string",
+                        },
+                    },
+                ]
+            )
         return parameters
 
 
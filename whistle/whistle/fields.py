@@ -1,10 +1,28 @@
 import base64
+import functools
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
 
 import aws_encryption_sdk
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.apps import apps
 from django.core import checks
-from django.db import models
+from django.db import models, connections, DEFAULT_DB_ALIAS
+from django.db.models.query import (
+    FlatValuesListIterable,
+    ModelIterable,
+    NamedValuesListIterable,
+    ValuesIterable,
+    ValuesListIterable,
+)
+from django.db.models.query_utils import DeferredAttribute
 
 from whistle import settings
+from whistle.kms import get_master_key_provider, get_master_key_client
 
 kms_client = aws_encryption_sdk.EncryptionSDKClient()
 
@@ -22,16 +40,304 @@ field_arns = {
 }
 
 
+class EncryptionModeChoices(models.TextChoices):
+    SDK = "SDK", "SDK"
+    ENVELOPE = "ENVELOPE", "ENVELOPE"
+
+
+ENVELOPE_PREFIX = "$1$"
+
+data_keys = {}
+active_data_keys = {}
+data_keys_lock = threading.Lock()
+
+
+def is_envelope_cipher_text(value):
+    return value.startswith(ENVELOPE_PREFIX)
+
+
+def envelope_encrypt(field_type, values):
+    key_id, cipher = get_active_data_key(field_type)
+    associated_data = field_type.encode()
+    cipher_texts = []
+    for value in values:
+        nonce = os.urandom(12)
+        encrypted = cipher.encrypt(nonce, value.encode(), associated_data)
+        cipher_texts.append(
+            f"{ENVELOPE_PREFIX}{key_id}${base64.b64encode(nonce + encrypted).decode()}"
+        )
+    return cipher_texts
+
+
+def envelope_decrypt(field_type, values):
+    associated_data = field_type.encode()
+    plaintexts = []
+    for value in values:
+        key_id, payload = value[len(ENVELOPE_PREFIX) :].split("$", 1)
+        payload = base64.b64decode(payload.encode())
+        cipher = get_data_key(int(key_id))
+        plaintexts.append(
+            cipher.decrypt(payload[:12], payload[12:], associated_data).decode()
+        )
+    return plaintexts
+
+
+def get_active_data_key(field_type):
+    with data_keys_lock:
+        active = active_data_keys.get(field_type)
+        if active and active[2] > time.monotonic():
+            return active[0], active[1]
+
+        DataKey = apps.get_model("encryption", "DataKey")
+        master_key_id = field_arns[field_type]
+        data_key = (
+            DataKey.objects.filter(
+                field_type=field_type,
+                master_key_id=master_key_id,
+                created_at__gte=datetime.now(timezone.utc)
+                - timedelta(seconds=settings.KMS_DATA_KEY_MAX_AGE),
+            )
+            .order_by("-created_at")
+            .first()
+        )
+        if data_key:
+            key_id, created_at = data_key.id, data_key.created_at
+            cipher = AESGCM(unwrap_data_key(data_key))
+        else:
+            key_id, created_at, plaintext_key = create_data_key(
+                field_type, master_key_id
+            )
+            cipher = AESGCM(plaintext_key)
+
+        age = (datetime.now(timezone.utc) - created_at).total_seconds()
+        data_keys[key_id] = cipher
+        active_data_keys[field_type] = (
+            key_id,
+            cipher,
+            time.monotonic() + settings.KMS_DATA_KEY_MAX_AGE - age,
+        )
+        return key_id, cipher
+
+
+def get_data_key(key_id):
+    cipher = data_keys.get(key_id)
+    if cipher is None:
+        with data_keys_lock:
+            DataKey = apps.get_model("encryption", "DataKey")
+            cipher = AESGCM(unwrap_data_key(DataKey.objects.get(pk=key_id)))
+            data_keys[key_id] = cipher
+    return cipher
+
+
+def unwrap_data_key(data_key):
+    response = get_master_key_client().decrypt(
+        CiphertextBlob=bytes(data_key.wrapped_key),
+        KeyId=data_key.master_key_id,
+        EncryptionContext={"field_type": data_key.field_type},
+    )
+    return response["Plaintext"]
+
+
+def create_data_key(field_type, master_key_id):
+    response = get_master_key_client().generate_data_key(
+        KeyId=master_key_id,
+        KeySpec="AES_256",
+        EncryptionContext={"field_type": field_type},
+    )
+    created_at = datetime.now(timezone.utc)
+
+    # the key is persisted on its own connection so that it is committed even if
+    # the caller's transaction rolls back after other processes started using it
+    DataKey = apps.get_model("encryption", "DataKey")
+    connection = connections.create_connection(DEFAULT_DB_ALIAS)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {connection.ops.quote_name(DataKey._meta.db_table)} "
+                "(field_type, master_key_id, wrapped_key, created_at) "
+                "VALUES (%s, %s, %s, %s) RETURNING id",
+                [field_type, master_key_id, response["CiphertextBlob"], created_at],
+            )
+            key_id = cursor.fetchone()[0]
+    finally:
+        connection.close()
+
+    return key_id, created_at, response["Plaintext"]
+
+
+class EncryptedValue:
+    __slots__ = ("cipher_text", "field")
+
+    def __init__(self, cipher_text, field):
+        self.cipher_text = cipher_text
+        self.field = field
+
+    def decrypt(self):
+        return self.field.decrypt(self.cipher_text)
+
+    def __str__(self):
+        return self.decrypt()
+
+    def __repr__(self):
+        return f"<EncryptedValue: {self.field.field_type}>"
+
+
+class EncryptedAttribute(DeferredAttribute):
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, EncryptedValue):
+            value = value.decrypt()
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+
+def is_encrypted(instance, attname):
+    return isinstance(instance.__dict__.get(attname), EncryptedValue)
+
+
+@functools.cache
+def get_decrypt_executor():
+    return ThreadPoolExecutor(
+        max_workers=settings.KMS_DECRYPT_WORKERS, thread_name_prefix="decrypt"
+    )
+
+
+def decrypt_instances(instances, field_names=None):
+    if not instances:
+        return instances
+
+    for field in instances[0]._meta.concrete_fields:
+        if not isinstance(field, EncryptedField):
+            continue
+        if field_names is not None and field.name not in field_names:
+            continue
+        pending = [
+            instance for instance in instances if is_encrypted(instance, field.attname)
+        ]
+        if not pending:
+            continue
+        plaintexts = field.decrypt_many(
+            [instance.__dict__[field.attname].cipher_text for instance in pending]
+        )
+        for instance, plaintext in zip(pending, plaintexts):
+            instance.__dict__[field.attname] = plaintext
+    return instances
+
+
+class DecryptingModelIterable(ModelIterable):
+    def __iter__(self):
+        batch = []
+        for instance in super().__iter__():
+            batch.append(instance)
+            if len(batch) >= self.chunk_size:
+                yield from decrypt_instances(batch)
+                batch = []
+        yield from decrypt_instances(batch)
+
+
+def decrypt_values(values):
+    pending = {}
+    for index, value in enumerate(values):
+        if isinstance(value, EncryptedValue):
+            pending.setdefault(value.field, []).append(index)
+    for field, indexes in pending.items():
+        plaintexts = field.decrypt_many(
+            [values[index].cipher_text for index in indexes]
+        )
+        for index, plaintext in zip(indexes, plaintexts):
+            values[index] = plaintext
+    return values
+
+
+class DecryptingValuesIterableMixin:
+    # values() rows never reach the descriptor, so they are decrypted one chunk at a time
+    def __iter__(self):
+        rows = super().__iter__()
+        while batch := list(itertools.islice(rows, self.chunk_size)):
+            width = len(self.unpack(batch[0]))
+            values = decrypt_values(
+                [value for row in batch for value in self.unpack(row)]
+            )
+            for index, row in enumerate(batch):
+                yield self.pack(row, values[index * width : (index + 1) * width])
+
+
+class DecryptingValuesIterable(DecryptingValuesIterableMixin, ValuesIterable):
+    def unpack(self, row):
+        return list(row.values())
+
+    def pack(self, row, values):
+        return dict(zip(row, values))
+
+
+class DecryptingValuesListIterable(DecryptingValuesIterableMixin, ValuesListIterable):
+    def unpack(self, row):
+        return row
+
+    def pack(self, row, values):
+        return tuple(values)
+
+
+class DecryptingNamedValuesListIterable(
+    DecryptingValuesIterableMixin, NamedValuesListIterable
+):
+    def unpack(self, row):
+        return row
+
+    def pack(self, row, values):
+        return row._make(values)
+
+
+class DecryptingFlatValuesListIterable(
+    DecryptingValuesIterableMixin, FlatValuesListIterable
+):
+    def unpack(self, row):
+        return [row]
+
+    def pack(self, row, values):
+        return values[0]
+
+
+decrypting_iterables = {
+    ValuesIterable: DecryptingValuesIterable,
+    ValuesListIterable: DecryptingValuesListIterable,
+    NamedValuesListIterable: DecryptingNamedValuesListIterable,
+    FlatValuesListIterable: DecryptingFlatValuesListIterable,
+}
+
+
+class EncryptedQuerySet(models.QuerySet):
+    def decrypted(self):
+        clone = self._chain()
+        clone._iterable_class = DecryptingModelIterable
+        return clone
+
+    def values(self, *fields, **expressions):
+        clone = super().values(*fields, **expressions)
+        clone._iterable_class = decrypting_iterables[clone._iterable_class]
+        return clone
+
+    def values_list(self, *fields, flat=False, named=False):
+        clone = super().values_list(*fields, flat=flat, named=named)
+        clone._iterable_class = decrypting_iterables[clone._iterable_class]
+        return clone
+
+
 class EncryptedField(models.CharField):
+    descriptor_class = EncryptedAttribute
+
     def __init__(
         self, field_type, cache_expiry=settings.KMS_CACHE_EXPIRY, *args, **kwargs
     ):
         kwargs.setdefault("editable", True)
         self.field_type = field_type
         self.key_id = field_arns[self.field_type]
-        self.kms_key_provider = aws_encryption_sdk.StrictAwsKmsMasterKeyProvider(
-            key_ids=[self.key_id]
-        )
+        self.kms_key_provider = get_master_key_provider(self.key_id)
         self.cache_expiry = cache_expiry
         self.cache_cmm = aws_encryption_sdk.CachingCryptoMaterialsManager(
             master_key_provider=self.kms_key_provider,
@@ -60,14 +366,65 @@ class EncryptedField(models.CharField):
             *extra_checks,
         ]
 
+    def encrypt(self, value):
+        return self.encrypt_many([value])[0]
+
+    def decrypt(self, value):
+        return self.decrypt_many([value])[0]
+
+    def encrypt_many(self, values):
+        if settings.KMS_ENCRYPTION_MODE == EncryptionModeChoices.ENVELOPE:
+            return envelope_encrypt(self.field_type, values)
+        return [self.sdk_encrypt(value) for value in values]
+
+    def decrypt_many(self, values):
+        envelope_values = [value for value in values if is_envelope_cipher_text(value)]
+        plaintexts = dict(
+            zip(envelope_values, envelope_decrypt(self.field_type, envelope_values))
+        )
+        sdk_values = [value for value in values if value not in plaintexts]
+        if len(sdk_values) > 1:
+            plaintexts.update(
+                zip(
+                    sdk_values,
+                    get_decrypt_executor().map(self.sdk_decrypt, sdk_values),
+                )
+            )
+        elif sdk_values:
+            plaintexts[sdk_values[0]] = self.sdk_decrypt(sdk_values[0])
+        return [plaintexts[value] for value in values]
+
+    def sdk_encrypt(self, value):
+        cipher_text, encryptor_header = kms_client.encrypt(
+            source=value.encode(),
+            materials_manager=self.cache_cmm,
+        )
+        return base64.b64encode(cipher_text).decode()
+
+    def sdk_decrypt(self, value):
+        decrypted_plaintext, decryptor_header = kms_client.decrypt(
+            source=base64.b64decode(value.encode()),
+            materials_manager=self.cache_cmm,
+        )
+        return decrypted_plaintext.decode()
+
+    def pre_save(self, model_instance, add):
+        if is_encrypted(model_instance, self.attname):
+            value = model_instance.__dict__[self.attname]
+            # legacy SDK values are re-encrypted once envelope mode is enabled
+            if (
+                settings.KMS_ENCRYPTION_MODE != EncryptionModeChoices.ENVELOPE
+                or is_envelope_cipher_text(value.cipher_text)
+            ):
+                return value
+        return super().pre_save(model_instance, add)
+
     def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, EncryptedValue):
+            return super().get_db_prep_value(value.cipher_text, connection, prepared)
         if isinstance(value, str) and value:
-            cipher_text, encryptor_header = kms_client.encrypt(
-                source=value.encode(),
-                materials_manager=self.cache_cmm,
-            )
             return super().get_db_prep_value(
-                base64.b64encode(cipher_text).decode(),
+                self.encrypt(value),
                 connection,
                 prepared,
             )
@@ -75,12 +432,9 @@ class EncryptedField(models.CharField):
 
     def from_db_value(self, value, expression, connection):
         if value:
-            decrypted_plaintext, decryptor_header = kms_client.decrypt(
-                source=base64.b64decode(value.encode()),
-                materials_manager=self.cache_cmm,
-            )
-            data = decrypted_plaintext.decode()
-            return data
+            # decryption is deferred until the attribute is first read, EncryptedQuerySet
+            # decrypts values() rows, other querysets return EncryptedValue as is
+            return EncryptedValue(value, self)
         return value
 
     def to_python(self, value):
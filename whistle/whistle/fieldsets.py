@@ -0,0 +1,154 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+
+
+def parse_fields(value):
+    fields = {}
+    for path in filter(None, (item.strip() for item in value.split(","))):
+        node = fields
+        *parents, name = path.split(".")
+        for parent in parents:
+            if node.get(parent) is None:
+                node[parent] = {}
+            node = node[parent]
+        node.setdefault(name, None)
+    return fields
+
+
+class SparseFieldsetSerializerMixin:
+    def __init__(self, *args, fields=None, expand=None, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        if expand is not None:
+            for name, field in list(self.fields.items()):
+                if name in expand or not isinstance(field, serializers.BaseSerializer):
+                    continue
+                self.fields[name] = serializers.PrimaryKeyRelatedField(
+                    read_only=True,
+                    many=isinstance(field, serializers.ListSerializer),
+                    **({"source": field.source} if field.source != name else {}),
+                )
+
+        if fields is not None:
+            prune_fields(self, fields)
+
+
+def prune_fields(serializer, fields, prefix=""):
+    readable_fields = {
+        name for name, field in serializer.fields.items() if not field.write_only
+    }
+    for name in fields:
+        if name not in readable_fields:
+            raise ValidationError(
+                f"'{prefix}{name}' is not a valid field. Please provide a comma separated list of valid fields.",
+                "invalid_fields",
+            )
+
+    for name in list(serializer.fields):
+        if name not in fields:
+            serializer.fields.pop(name)
+        elif fields[name]:
+            nested = serializer.fields[name]
+            if isinstance(nested, serializers.ListSerializer):
+                nested = nested.child
+            if not isinstance(nested, serializers.Serializer):
+                raise ValidationError(
+                    f"'{prefix}{name}' is not an expandable field.",
+                    "invalid_fields",
+                )
+            prune_fields(nested, fields[name], prefix=f"{prefix}{name}.")
+
+
+def optimize_queryset(queryset, serializer):
+    only, select_related, prefetch_related = collect_related_fields(
+        serializer, queryset.model
+    )
+    queryset = queryset.select_related(None).prefetch_related(None)
+    if select_related:
+        # select_related() without arguments would follow every foreign key
+        queryset = queryset.select_related(*select_related)
+    return queryset.prefetch_related(*prefetch_related).only(*only)
+
+
+def collect_related_fields(serializer, model, prefix=""):
+    only = [f"{prefix}{model._meta.pk.name}"]
+    select_related = []
+    prefetch_related = []
+
+    for field in serializer.fields.values():
+        if field.write_only or field.source == "*":
+            continue
+        try:
+            model_field = model._meta.get_field(field.source.split(".")[0])
+        except FieldDoesNotExist:
+            continue
+
+        nested = field.child if isinstance(field, serializers.ListSerializer) else field
+        if model_field.one_to_many or model_field.many_to_many:
+            related_model = model_field.related_model
+            related_only = [related_model._meta.pk.name]
+            if isinstance(nested, serializers.Serializer):
+                related_only, _, _ = collect_related_fields(nested, related_model)
+            if model_field.one_to_many:
+                related_only.append(model_field.field.name)
+            prefetch_related.append(
+                Prefetch(
+                    f"{prefix}{model_field.name}",
+                    queryset=related_model.objects.only(*related_only),
+                )
+            )
+        elif model_field.is_relation and isinstance(nested, serializers.Serializer):
+            only.append(f"{prefix}{model_field.name}")
+            select_related.append(f"{prefix}{model_field.name}")
+            related_only, related_select, _ = collect_related_fields(
+                nested,
+                model_field.related_model,
+                prefix=f"{prefix}{model_field.name}__",
+            )
+            only.extend(related_only)
+            select_related.extend(related_select)
+        elif model_field.concrete:
+            only.append(f"{prefix}{model_field.name}")
+
+    return only, select_related, prefetch_related
+
+
+class SparseFieldsetMixin:
+    fields_query_param = "fields"
+    expand_query_param = "expand"
+    sparse_fieldset_actions = ["list", "retrieve"]
+
+    def get_fieldset(self):
+        fields = None
+        expand = None
+        if self.fields_query_param in self.request.query_params:
+            fields = parse_fields(self.request.query_params[self.fields_query_param])
+        if self.expand_query_param in self.request.query_params:
+            expand = set(
+                parse_fields(self.request.query_params[self.expand_query_param])
+            )
+            if fields is not None:
+                expand.update(name for name, nested in fields.items() if nested)
+        return fields, expand
+
+    def has_sparse_fieldset(self):
+        fields, expand = self.get_fieldset()
+        return self.action in self.sparse_fieldset_actions and (
+            fields is not None or expand is not None
+        )
+
+    def get_serializer(self, *args, **kwargs):
+        if self.has_sparse_fieldset():
+            fields, expand = self.get_fieldset()
+            kwargs.setdefault("fields", fields)
+            kwargs.setdefault("expand", expand)
+        return super().get_serializer(*args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.has_sparse_fieldset():
+            # unrequested columns, encrypted ones included, are never loaded or decrypted
+            queryset = optimize_queryset(queryset, self.get_serializer())
+        return queryset
@@ -0,0 +1,97 @@
+import base64
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+
+import aws_encryption_sdk
+import boto3
+from aws_encryption_sdk.identifiers import EncryptionKeyType, WrappingAlgorithm
+from aws_encryption_sdk.internal.crypto.wrapping_keys import WrappingKey
+from aws_encryption_sdk.key_providers.raw import RawMasterKeyProvider
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.db import models
+
+from whistle import settings
+
+
+class MasterKeyProviderChoices(models.TextChoices):
+    AWS = "AWS", "AWS"
+    LOCAL = "LOCAL", "LOCAL"
+
+
+local_master_key = None
+local_master_key_lock = threading.Lock()
+
+
+def get_local_master_key():
+    global local_master_key
+    with local_master_key_lock:
+        if local_master_key is None:
+            if settings.KMS_LOCAL_MASTER_KEY:
+                local_master_key = base64.b64decode(settings.KMS_LOCAL_MASTER_KEY)
+            else:
+                logging.warning(
+                    "KMS_LOCAL_MASTER_KEY not set, values encrypted by this process can only be decrypted by it"
+                )
+                local_master_key = os.urandom(32)
+        return local_master_key
+
+
+def derive_local_key(key_id):
+    if isinstance(key_id, str):
+        key_id = key_id.encode()
+    return hmac.new(get_local_master_key(), key_id, hashlib.sha256).digest()
+
+
+class LocalMasterKeyProvider(RawMasterKeyProvider):
+    provider_id = "whistle-local"
+
+    def _get_raw_key(self, key_id):
+        return WrappingKey(
+            wrapping_algorithm=WrappingAlgorithm.AES_256_GCM_IV12_TAG16_NO_PADDING,
+            wrapping_key=derive_local_key(key_id),
+            wrapping_key_type=EncryptionKeyType.SYMMETRIC,
+        )
+
+
+class LocalKmsClient:
+    # mirrors the subset of the boto3 KMS client used for envelope encryption
+
+    def generate_data_key(self, KeyId, KeySpec, EncryptionContext):
+        plaintext = os.urandom(32)
+        nonce = os.urandom(12)
+        wrapped = AESGCM(derive_local_key(KeyId)).encrypt(
+            nonce, plaintext, json.dumps(EncryptionContext, sort_keys=True).encode()
+        )
+        return {
+            "KeyId": KeyId,
+            "Plaintext": plaintext,
+            "CiphertextBlob": nonce + wrapped,
+        }
+
+    def decrypt(self, CiphertextBlob, KeyId, EncryptionContext):
+        plaintext = AESGCM(derive_local_key(KeyId)).decrypt(
+            CiphertextBlob[:12],
+            CiphertextBlob[12:],
+            json.dumps(EncryptionContext, sort_keys=True).encode(),
+        )
+        return {"KeyId": KeyId, "Plaintext": plaintext}
+
+
+def get_master_key_provider(key_id):
+    if settings.KMS_MASTER_KEY_PROVIDER == MasterKeyProviderChoices.LOCAL:
+        provider = LocalMasterKeyProvider()
+        provider.add_master_key(key_id)
+        return provider
+    return aws_encryption_sdk.StrictAwsKmsMasterKeyProvider(key_ids=[key_id])
+
+
+@functools.cache
+def get_master_key_client():
+    if settings.KMS_MASTER_KEY_PROVIDER == MasterKeyProviderChoices.LOCAL:
+        return LocalKmsClient()
+    return boto3.client("kms")
@@ -42,6 +42,7 @@ if ENVIRONMENT and SENTRY_DSN:
     )
 
 INSTALLED_APPS = [
+    "encryption",
     "notification",
     "external_user",
     "preference",
@@ -64,11 +65,19 @@ INSTALLED_APPS = [
     "drf_spectacular",
 ]
 
+# comma separated hosts shard groups and channels by a hash of their name, every
+# process publishing or consuming must list the same hosts in the same order
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [os.environ.get("CHANNELS_REDIS", "redis://127.0.0.1:6379/0")],
+            "hosts": [
+                host.strip()
+                for host in os.environ.get(
+                    "CHANNELS_REDIS", "redis://127.0.0.1:6379/0"
+                ).split(",")
+                if host.strip()
+            ],
         },
     },
 }
@@ -211,6 +220,8 @@ CELERY_TASK_QUEUES = (
     Queue("broadcasts", Exchange("broadcasts"), "broadcasts"),
     Queue("notifications", Exchange("notifications"), "notifications"),
     Queue("outbound", Exchange("outbound"), "outbound"),
+    Queue("imports", Exchange("imports"), "imports"),
+    Queue("maintenance", Exchange("maintenance"), "maintenance"),
     Queue("dead_letter", Exchange("dead_letter"), "dead_letter"),
 )
 CELERY_RETRY_BACKOFF = os.getenv("CELERY_RETRY_BACKOFF", 30)
@@ -222,13 +233,91 @@ CELERY_BEAT_MAX_LOOP_INTERVAL = 5
 REDBEAT_LOCK_TIMEOUT = CELERY_BEAT_MAX_LOOP_INTERVAL + 60
 REDBEAT_REDIS_URL = os.environ.get("REDBEAT_REDIS_URL", "redis://127.0.0.1:6379/0")
 
+REDIS_CACHE_URL = os.environ.get("REDIS_CACHE_URL", "redis://127.0.0.1:6379/0")
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": REDIS_CACHE_URL,
+    }
+}
+
+JWT_PRINCIPAL_CACHE_TIMEOUT = int(os.getenv("JWT_PRINCIPAL_CACHE_TIMEOUT", 300))
+API_CREDENTIALS_CACHE_SIZE = int(os.getenv("API_CREDENTIALS_CACHE_SIZE", 1024))
+API_CREDENTIALS_CACHE_TTL = int(os.getenv("API_CREDENTIALS_CACHE_TTL", 30))
+API_CREDENTIALS_REDIS_CACHE_TTL = int(os.getenv("API_CREDENTIALS_REDIS_CACHE_TTL", 300))
+API_CREDENTIALS_GENERATION_CHECK_INTERVAL = float(
+    os.getenv("API_CREDENTIALS_GENERATION_CHECK_INTERVAL", 5.0)
+)
+EXTERNAL_USER_CACHE_TTL = int(os.getenv("EXTERNAL_USER_CACHE_TTL", 60))
+REALTIME_CONNECTION_TOKEN_MAX_AGE = int(
+    os.getenv("REALTIME_CONNECTION_TOKEN_MAX_AGE", 60)
+)
+
+BUFFER_ENGAGEMENT_EVENTS = bool(int(os.getenv("BUFFER_ENGAGEMENT_EVENTS", 1)))
+ENGAGEMENT_FLUSH_INTERVAL = float(os.getenv("ENGAGEMENT_FLUSH_INTERVAL", 5.0))
+ENGAGEMENT_FLUSH_BATCH_SIZE = int(os.getenv("ENGAGEMENT_FLUSH_BATCH_SIZE", 1000))
+ENGAGEMENT_FLUSH_MAX_BATCHES = int(os.getenv("ENGAGEMENT_FLUSH_MAX_BATCHES", 50))
+
+IN_APP_BATCH_SIZE = int(os.getenv("IN_APP_BATCH_SIZE", 1000))
+REALTIME_PRESENCE_TTL = int(os.getenv("REALTIME_PRESENCE_TTL", 90))
+REALTIME_PRESENCE_HEARTBEAT_INTERVAL = int(
+    os.getenv("REALTIME_PRESENCE_HEARTBEAT_INTERVAL", 30)
+)
+REALTIME_PRESENCE_GRACE_PERIOD = int(os.getenv("REALTIME_PRESENCE_GRACE_PERIOD", 30))
+REALTIME_EVENT_LOG_MAXLEN = int(os.getenv("REALTIME_EVENT_LOG_MAXLEN", 100))
+REALTIME_EVENT_LOG_TTL = int(os.getenv("REALTIME_EVENT_LOG_TTL", 3600))
+REALTIME_TOPIC_GROUPS_CACHE_TTL = int(
+    os.getenv("REALTIME_TOPIC_GROUPS_CACHE_TTL", 3600)
+)
+REALTIME_SSE_KEEPALIVE_INTERVAL = int(os.getenv("REALTIME_SSE_KEEPALIVE_INTERVAL", 15))
+REALTIME_SSE_MAX_DURATION = int(os.getenv("REALTIME_SSE_MAX_DURATION", 3600))
+REALTIME_COALESCE_INTERVAL = float(os.getenv("REALTIME_COALESCE_INTERVAL", 0.01))
+REALTIME_COALESCE_MAX_EVENTS = int(os.getenv("REALTIME_COALESCE_MAX_EVENTS", 100))
+REALTIME_WEBSOCKET_COMPRESSION = bool(
+    int(os.getenv("REALTIME_WEBSOCKET_COMPRESSION", 1))
+)
+REALTIME_COMPRESSION_WINDOW_BITS = int(
+    os.getenv("REALTIME_COMPRESSION_WINDOW_BITS", 12)
+)
+
+CELERY_BEAT_SCHEDULE = {
+    "flush-engagement-events": {
+        "task": "notification.tasks.flush_engagement_events",
+        "schedule": ENGAGEMENT_FLUSH_INTERVAL,
+    },
+}
+
 JWKS_ENDPOINT_URL = os.getenv("JWKS_ENDPOINT_URL")
 
-KMS_PERSONAL_DATA_KEY_ARN = os.environ["KMS_PERSONAL_DATA_KEY_ARN"]
-KMS_API_CREDENTIALS_KEY_ARN = os.environ["KMS_API_CREDENTIALS_KEY_ARN"]
+KMS_MASTER_KEY_PROVIDER = os.getenv("KMS_MASTER_KEY_PROVIDER", "AWS")
+if KMS_MASTER_KEY_PROVIDER == "LOCAL":
+    KMS_PERSONAL_DATA_KEY_ARN = os.getenv("KMS_PERSONAL_DATA_KEY_ARN", "personal-data")
+    KMS_API_CREDENTIALS_KEY_ARN = os.getenv(
+        "KMS_API_CREDENTIALS_KEY_ARN", "api-credentials"
+    )
+else:
+    KMS_PERSONAL_DATA_KEY_ARN = os.environ["KMS_PERSONAL_DATA_KEY_ARN"]
+    KMS_API_CREDENTIALS_KEY_ARN = os.environ["KMS_API_CREDENTIALS_KEY_ARN"]
+KMS_LOCAL_MASTER_KEY = os.getenv("KMS_LOCAL_MASTER_KEY")
 KMS_CACHE_CAPACITY = os.getenv("KMS_CACHE_CAPACITY", 100)
 KMS_CACHE_EXPIRY = os.getenv("KMS_CACHE_EXPIRY", 1800.0)
+KMS_ENCRYPTION_MODE = os.getenv("KMS_ENCRYPTION_MODE", "SDK")
+KMS_DATA_KEY_MAX_AGE = float(os.getenv("KMS_DATA_KEY_MAX_AGE", 86400.0))
+KMS_DECRYPT_WORKERS = int(os.getenv("KMS_DECRYPT_WORKERS", 8))
 
 USE_SENDGRID_SANDBOX = bool(os.getenv("USE_SENDGRID_SANDBOX", 0))
 
 MAX_BROADCAST_RECIPIENTS = os.getenv("MAX_BROADCAST_RECIPIENTS", 2500)
+
+MAX_INBOX_BULK_UPDATE_IDS = int(os.getenv("MAX_INBOX_BULK_UPDATE_IDS", 500))
+
+EXTERNAL_USER_IMPORT_CHUNK_SIZE = int(
+    os.getenv("EXTERNAL_USER_IMPORT_CHUNK_SIZE", 1000)
+)
+EXTERNAL_USER_IMPORT_MAX_ERRORS = int(
+    os.getenv("EXTERNAL_USER_IMPORT_MAX_ERRORS", 1000)
+)
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 2000))
+EXPORT_BUFFER_SIZE = int(os.getenv("EXPORT_BUFFER_SIZE", 65536))
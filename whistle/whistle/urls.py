@@ -18,7 +18,7 @@ Including another URLconf
 from django.urls import path, include
 from rest_framework.routers import SimpleRouter
 
-from audience.views import AudienceViewSet
+from audience.views import AudienceViewSet, MetadataKeyViewSet
 from provider.views import TwilioViewSet, SendgridViewSet, APNSViewSet, FCMViewSet
 from external_user.views import (
     ExternalUserViewSet,
@@ -32,6 +32,7 @@ from notification.views import (
 )
 from organization.views import OrganizationViewSet, OrganizationCredentialsViewSet
 from preference.views import PreferenceViewSet
+from realtime.views import ConnectionTokenViewSet, NotificationStreamView
 from subscription.views import SubscriptionViewSet
 
 # DO NOT REMOVE used for openapi spec generation
@@ -60,9 +61,14 @@ v1_router.register(
 v1_router.register(r"providers/twilio", TwilioViewSet, basename="providers.twilio")
 v1_router.register(r"providers/apns", APNSViewSet, basename="providers.apns")
 v1_router.register(r"providers/fcm", FCMViewSet, basename="providers.fcm")
+v1_router.register(
+    r"audiences/metadata-keys", MetadataKeyViewSet, basename="audiences.metadata_keys"
+)
 v1_router.register(r"audiences", AudienceViewSet, basename="audiences")
+v1_router.register(r"realtime/token", ConnectionTokenViewSet, basename="realtime.token")
 
 urlpatterns = [
     path(r"health", include("health_check.urls")),
+    path(r"api/v1/realtime/stream", NotificationStreamView.as_view()),
     path(r"api/v1/", include(v1_router.urls)),
 ]